@@ -0,0 +1,88 @@
+# Peak memory of one blob upload, old path against the streamed one
+#
+# Usage (from the repository root):
+#   python benchmarks/blob_upload.py [size in KB ...]
+#
+# old: base64.encodestring of the PNG (what process.run used to return), then
+#      Repository.create_git_blob, which puts it in a dict and json.dumps it.
+# new: Repository.create_git_blob_from_data, encoding once without line breaks
+#      and writing the JSON envelope around it to the connection.
+#
+# Posts to a local server standing in for GitHub, which checks that both paths
+# create the same blob. Python 2 has no tracemalloc, so every upload runs in its
+# own process and the growth of ru_maxrss over the upload is what is reported.
+import sys
+sys.path.insert(0, 'lib')
+sys.path.insert(0, 'deployers')
+sys.path.insert(0, '.')
+import BaseHTTPServer
+import base64
+import json
+import os
+import resource
+import subprocess
+import threading
+from lib.github import Github
+import github.Repository
+from blob_store import git_blob_sha
+
+SIZES = [512, 4096]
+
+class BlobHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+  protocol_version = 'HTTP/1.1'
+
+  def do_POST(self):
+    body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+    sha = git_blob_sha(base64.b64decode(body['content']))
+    output = json.dumps({'sha': sha, 'url': 'http://%s/blobs/%s' % (self.headers['Host'], sha)})
+    self.send_response(201)
+    self.send_header('Content-Type', 'application/json')
+    self.send_header('Content-Length', str(len(output)))
+    self.end_headers()
+    self.wfile.write(output)
+
+  def log_message(self, *args):
+    pass
+
+def max_rss():
+  # KB on Linux
+  return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def upload(mode, size, port):
+  # Random bytes don't compress, like a PNG
+  png = os.urandom(size * 1024)
+  base_url = 'http://127.0.0.1:%d' % (port)
+  requester = Github(base_url = base_url)._Github__requester
+  repo = github.Repository.Repository(requester, {}, {'url': base_url + '/repos/owner/repo'}, completed = True)
+  # Connection and imports out of the way
+  repo.create_git_blob_from_data('warm up')
+  repo.create_git_blob(base64.encodestring('warm up'), 'base64')
+  before = max_rss()
+  if mode == 'old':
+    blob = repo.create_git_blob(base64.encodestring(png), 'base64')
+  else:
+    blob = repo.create_git_blob_from_data(png)
+  if blob.sha != git_blob_sha(png):
+    raise ValueError("%s created blob %s" % (mode, blob.sha))
+  print max_rss() - before
+
+def main(sizes):
+  server = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), BlobHandler)
+  thread = threading.Thread(target = server.serve_forever)
+  thread.daemon = True
+  thread.start()
+  port = server.server_address[1]
+  print "%10s %12s %12s %8s" % ("size(KB)", "old(KB)", "new(KB)", "ratio")
+  for size in sizes:
+    peaks = {}
+    for mode in ['old', 'new']:
+      output = subprocess.check_output([sys.executable, __file__, '--child', mode, str(size), str(port)])
+      peaks[mode] = int(output)
+    print "%10d %12d %12d %7.1fx" % (size, peaks['old'], peaks['new'], float(peaks['old']) / max(peaks['new'], 1))
+  server.shutdown()
+
+if __name__ == '__main__':
+  if sys.argv[1:2] == ['--child']:
+    upload(sys.argv[2], int(sys.argv[3]), int(sys.argv[4]))
+  else:
+    main([int(size) for size in sys.argv[1:]] or SIZES)
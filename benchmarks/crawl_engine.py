@@ -0,0 +1,52 @@
+# Compare the thread and event crawl engines
+#
+# Usage (from the repository root):
+#   python benchmarks/crawl_engine.py [station pages] [delay ms]
+#
+# Serves the synthetic nmc.gov.cn site of benchmarks/crawl_queue.py on
+# 127.0.0.1, every response delayed to stand in for the network. asyncio and
+# aiohttp don't exist on Python 2, the event engine is select() based.
+import sys
+sys.path.insert(0, 'benchmarks')
+sys.path.insert(0, 'lib')
+sys.path.insert(0, '.')
+import time
+import logging
+import threading
+from crawler import Crawler
+from crawl_queue import FixtureServer, make_handler, STATIONS
+
+DELAY = 50
+
+ENGINES = [
+  ('thread', dict(engine = 'thread', max_thread = 10)),
+  ('thread-50', dict(engine = 'thread', max_thread = 50)),
+  ('event', dict(engine = 'event', max_fetch = 100)),
+  ('event-300', dict(engine = 'event', max_fetch = 300))
+]
+
+def crawl(base, options):
+  white_rules = ['http:\\/\\/127\\.0\\.0\\.1:\\d+\\/(station|frames)\\/']
+  crawler = Crawler(white_rules, [], 2, **options)
+  start = time.time()
+  crawler.walk([base + '/index.htm'])
+  return time.time() - start, crawler
+
+def main(count, delay):
+  logging.getLogger().setLevel(logging.CRITICAL)
+  FixtureServer.request_queue_size = 512
+  server = FixtureServer(('127.0.0.1', 0), make_handler(count, delay / 1000.0))
+  thread = threading.Thread(target = server.serve_forever)
+  thread.daemon = True
+  thread.start()
+  base = 'http://127.0.0.1:%d' % (server.server_address[1])
+  print "%-10s %8s %8s %10s %10s" % ("engine", "urls", "failed", "wall(s)", "p50(ms)")
+  for name, options in ENGINES:
+    cost, crawler = crawl(base, options)
+    print "%-10s %8d %8d %10.2f %10.0f" % (name, len(crawler.urls), crawler.fail_count, cost, crawler.client.stats['p50'])
+  server.shutdown()
+
+if __name__ == '__main__':
+  count = int(sys.argv[1]) if len(sys.argv) > 1 else STATIONS
+  delay = int(sys.argv[2]) if len(sys.argv) > 2 else DELAY
+  main(count, delay)
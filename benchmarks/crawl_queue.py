@@ -0,0 +1,102 @@
+# Compare the blocking-get crawler workers with the old 1-second polling loop
+#
+# Usage (from the repository root):
+#   python benchmarks/crawl_queue.py [station pages]
+#
+# A local fixture site is served on 127.0.0.1: an index page linking every
+# station page, and station pages linking a few frames, like the NMC radar site.
+import sys
+sys.path.insert(0, 'lib')
+sys.path.insert(0, '.')
+import time
+import logging
+import threading
+import BaseHTTPServer
+import SocketServer
+from crawler import Crawler, CrawlerThread, STOP
+
+STATIONS = 500
+FRAMES_PER_STATION = 3
+
+def station_page(id):
+  links = ''.join('<a href="/frames/%d_%d.GIF">%d</a>' % (id, i, i) for i in range(FRAMES_PER_STATION))
+  return '<html><body><a href="/index.htm">index</a>%s</body></html>' % (links)
+
+def index_page(count):
+  links = ''.join('<a href="/station/%d.htm">%d</a>' % (id, id) for id in range(count))
+  return '<html><body>%s</body></html>' % (links)
+
+class FixtureServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+  daemon_threads = True
+
+def make_handler(count, delay = 0):
+  # delay: seconds before every response, as a stand-in for network latency
+  class FixtureHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # One write per response, no waiting on delayed ACKs
+    wbufsize = -1
+
+    def do_GET(self):
+      time.sleep(delay)
+      if self.path == '/index.htm':
+        body = index_page(count)
+      elif self.path.startswith('/station/'):
+        body = station_page(int(self.path[len('/station/'):-len('.htm')]))
+      else:
+        self.send_error(404)
+        return
+      self.send_response(200)
+      self.send_header('Content-Type', 'text/html; charset=utf-8')
+      self.send_header('Content-Length', str(len(body)))
+      self.end_headers()
+      self.wfile.write(body)
+
+    def log_message(self, format, *args):
+      pass
+  return FixtureHandler
+
+# The worker loop before, kept here for comparison
+class PollingCrawlerThread(CrawlerThread):
+  def run(self):
+    crawler = self.crawler
+    while not crawler.shouldExit:
+      if not crawler.queue.empty():
+        task = crawler.queue.get()
+        if task is STOP:
+          # Exits on shouldExit instead
+          crawler.queue.task_done()
+          continue
+        self.current_retry = 0
+        succ = False
+        while self.current_retry <= self.max_retry:
+          succ = self.walk(task)
+          if succ:
+            break
+          self.current_retry += 1
+        if not succ:
+          crawler.queue.task_done()
+          crawler.fail_count += 1
+      time.sleep(1)
+
+def crawl(base, thread_klass):
+  white_rules = ['http:\\/\\/127\\.0\\.0\\.1:\\d+\\/(station|frames)\\/']
+  crawler = Crawler(white_rules, [], 2, thread_klass = thread_klass)
+  start = time.time()
+  crawler.walk([base + '/index.htm'])
+  return time.time() - start, crawler
+
+def main(count):
+  logging.getLogger().setLevel(logging.CRITICAL)
+  server = FixtureServer(('127.0.0.1', 0), make_handler(count))
+  thread = threading.Thread(target = server.serve_forever)
+  thread.daemon = True
+  thread.start()
+  base = 'http://127.0.0.1:%d' % (server.server_address[1])
+  print "%-10s %8s %8s %10s" % ("loop", "urls", "failed", "wall(s)")
+  for name, klass in [('blocking', CrawlerThread), ('polling', PollingCrawlerThread)]:
+    cost, crawler = crawl(base, klass)
+    print "%-10s %8d %8d %10.2f" % (name, len(crawler.urls), crawler.fail_count, cost)
+  server.shutdown()
+
+if __name__ == '__main__':
+  main(int(sys.argv[1]) if len(sys.argv) > 1 else STATIONS)
@@ -0,0 +1,28 @@
+# Compare process.inpaint with process.fast_inpaint
+#
+# Usage (from the repository root):
+#   python benchmarks/inpaint.py [frame.GIF ...]
+import sys
+sys.path.insert(0, 'deployers')
+sys.path.insert(0, 'benchmarks')
+import Image
+import process
+from process_backends import best_of, FRAMES
+
+def main(paths):
+  failed = False
+  print "%-20s %8s %14s %14s" % ("frame", "masked", "inpaint(ms)", "fast(ms)")
+  for path in paths:
+    radar, mask = process.prepare_pil(process.crop(Image.open(path)))
+    masked = sum(1 for m in mask.getdata() if m != 0)
+    slow_cost, slow = best_of(lambda: process.inpaint(radar, mask))
+    fast_cost, fast = best_of(lambda: process.fast_inpaint(radar, mask))
+    if list(slow.getdata()) != list(fast.getdata()):
+      failed = True
+      print "%s: fast_inpaint differs from inpaint" % (path)
+    print "%-20s %8d %14.1f %14.1f" % (path.split('/')[-1], masked, slow_cost * 1000, fast_cost * 1000)
+  if failed:
+    sys.exit(1)
+
+if __name__ == '__main__':
+  main(sys.argv[1:] or FRAMES)
@@ -0,0 +1,76 @@
+# Compare the link extractors in crawler/links.py
+#
+# Usage (from the repository root):
+#   python benchmarks/link_extract.py [page.htm ...]
+#
+# Without pages, a station page is synthesized after www.nmc.gov.cn: the
+# station menu, the frame list with javascript:view_text_img links and some
+# script and layout around them. Every extractor must find the same hrefs.
+#
+# Peak memory is the growth of ru_maxrss in a forked child doing one parse,
+# Python 2 has no tracemalloc.
+import sys
+sys.path.insert(0, 'benchmarks')
+sys.path.insert(0, '.')
+import os
+import resource
+from process_backends import best_of
+from crawler import soup_links, strainer_links, scan_links
+
+EXTRACTORS = [('soup', soup_links), ('strainer', strainer_links), ('scan', scan_links)]
+STATIONS = 200
+FRAMES = 60
+
+def frame_link(i):
+  path = "/product/2014/201408/20140812/RDCP/SEVP_AOC_RDCP_SLDAS_EBREF_AZ9010_L88_PI_2014081210%02d00000.GIF?v=%d" % (i % 60, i)
+  return "javascript:view_text_img('radar','%s','','','','','%s','','%s','','')" % (path, path, path)
+
+def station_page():
+  parts = ['<html><head><title>radar</title>']
+  parts.append('<script type="text/javascript">var frames = [];\nfunction view_text_img(a, b) { return a < b; }</script>')
+  parts.append('<link rel="stylesheet" href="/css/main.css"></head><body><div id="menu"><ul>')
+  for i in range(STATIONS):
+    parts.append('<li class="station"><a href="/publish/radar/stations-%d.htm" title="station %d">Station %d</a></li>' % (i, i, i))
+  parts.append('</ul></div><div id="content"><table class="frames">')
+  for i in range(FRAMES):
+    parts.append('<tr><td><a href="%s"><img src="/small/%d.gif" alt="frame %d"></a></td><td>2014-08-12 10:%02d</td></tr>' % (frame_link(i), i, i, i % 60))
+  parts.append('</table><p>&copy; 2014 &nbsp; <span>www.nmc.gov.cn</span></p></div></body></html>')
+  return ''.join(parts)
+
+def peak_memory(func, content):
+  read_fd, write_fd = os.pipe()
+  pid = os.fork()
+  if pid == 0:
+    os.close(read_fd)
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    list(func(content))
+    after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    os.write(write_fd, str(after - before))
+    os._exit(0)
+  os.close(write_fd)
+  result = os.read(read_fd, 64)
+  os.close(read_fd)
+  os.waitpid(pid, 0)
+  return int(result)
+
+def main(pages):
+  failed = False
+  print "%-12s %-10s %8s %10s %12s" % ("page", "extractor", "links", "parse(ms)", "peak(KB)")
+  for name, content in pages:
+    expected = None
+    for extractor, func in EXTRACTORS:
+      cost, links = best_of(lambda: list(func(content)))
+      if expected == None:
+        expected = links
+      elif links != expected:
+        failed = True
+        print "%s: %s found different links" % (name, extractor)
+      print "%-12s %-10s %8d %10.1f %12d" % (name, extractor, len(links), cost * 1000, peak_memory(func, content))
+  if failed:
+    sys.exit(1)
+
+if __name__ == '__main__':
+  pages = [(os.path.basename(path), unicode(open(path).read(), 'utf-8', errors = 'replace')) for path in sys.argv[1:]]
+  if not pages:
+    pages = [('synthesized', unicode(station_page()))]
+  main(pages)
@@ -0,0 +1,47 @@
+# Compare the frame processing backends in deployers/process.py
+#
+# Usage (from the repository root):
+#   python benchmarks/process_backends.py [frame.GIF ...]
+#
+# Every backend must produce the same PNG as the pure PIL path, otherwise
+# the script exits with an error.
+import sys
+sys.path.insert(0, 'deployers')
+import time
+import Image
+import process
+
+FRAMES = ['notes/radar1.GIF', 'notes/radar2.GIF']
+REPEAT = 3
+
+def best_of(func, repeat = REPEAT):
+  best = None
+  result = None
+  for i in range(repeat):
+    start = time.time()
+    result = func()
+    cost = time.time() - start
+    if best == None or cost < best:
+      best = cost
+  return best, result
+
+def main(paths):
+  failed = False
+  print "%-20s %-8s %12s %12s" % ("frame", "backend", "prepare(ms)", "run(ms)")
+  for path in paths:
+    image = Image.open(path)
+    expected = None
+    for backend in ['pil'] + sorted(b for b in process.BACKENDS if b != 'pil'):
+      prepare_cost, _ = best_of(lambda: process.BACKENDS[backend](process.crop(image)))
+      run_cost, output = best_of(lambda: process.run(image, backend))
+      if expected == None:
+        expected = output
+      elif output != expected:
+        failed = True
+        print "%s: %s output differs from pil" % (path, backend)
+      print "%-20s %-8s %12.1f %12.1f" % (path.split('/')[-1], backend, prepare_cost * 1000, run_cost * 1000)
+  if failed:
+    sys.exit(1)
+
+if __name__ == '__main__':
+  main(sys.argv[1:] or FRAMES)
@@ -0,0 +1,72 @@
+# Frame processing throughput in threads against process_pool.FramePool
+#
+# Usage (from the repository root):
+#   python benchmarks/process_pool.py [frames] [workers]
+#
+# Processes frames (500 by default, cycling through the sample GIFs) the way
+# the process stage does: threads calling FramePool.run with the GIF bytes.
+# Threads only (workers = 0, 2 threads) is the baseline, then every chunk size
+# with workers processes (the number of cores by default). Every mode must give
+# the same PNGs as the baseline, otherwise the script exits with an error.
+import sys
+sys.path.insert(0, 'deployers')
+import logging
+import multiprocessing
+import threading
+import time
+import Queue
+from process_pool import FramePool
+
+FRAMES = ['notes/radar1.GIF', 'notes/radar2.GIF']
+FRAME_COUNT = 500
+CHUNK_SIZES = [1, 4, 8]
+
+def process_all(pool, datas, thread_count):
+  tasks = Queue.Queue()
+  for i, data in enumerate(datas):
+    tasks.put((i, data))
+  outputs = [None] * len(datas)
+  def work():
+    while True:
+      try:
+        i, data = tasks.get_nowait()
+      except Queue.Empty:
+        return
+      outputs[i] = pool.run(data)
+  threads = [threading.Thread(target = work) for i in range(thread_count)]
+  start = time.time()
+  for t in threads:
+    t.start()
+  for t in threads:
+    t.join()
+  return time.time() - start, outputs
+
+def main(frame_count, workers):
+  logging.disable(logging.WARNING)
+  samples = [open(path, 'rb').read() for path in FRAMES]
+  datas = [samples[i % len(samples)] for i in range(frame_count)]
+  modes = [(0, 1)] + [(workers, chunk_size) for chunk_size in CHUNK_SIZES]
+  expected = None
+  failed = False
+  print "%d frames, %d cores" % (frame_count, multiprocessing.cpu_count())
+  print "%-8s %6s %8s %10s %10s %8s" % ("workers", "chunk", "threads", "total(s)", "frames/s", "speedup")
+  baseline = None
+  for pool_workers, chunk_size in modes:
+    pool = FramePool(pool_workers, chunk_size)
+    thread_count = pool.max_thread or 2
+    cost, outputs = process_all(pool, datas, thread_count)
+    pool.close()
+    if expected == None:
+      expected = outputs
+      baseline = cost
+    elif outputs != expected:
+      failed = True
+      print "workers %d chunk %d: different output" % (pool_workers, chunk_size)
+    print "%-8d %6d %8d %10.2f %10.1f %7.2fx" % (pool_workers, chunk_size, thread_count, cost, frame_count / cost, baseline / cost)
+  if failed:
+    sys.exit(1)
+
+if __name__ == '__main__':
+  frame_count = int(sys.argv[1]) if len(sys.argv) > 1 else FRAME_COUNT
+  workers = int(sys.argv[2]) if len(sys.argv) > 2 else multiprocessing.cpu_count()
+  main(frame_count, workers)
@@ -0,0 +1,44 @@
+# Compare process.run with and without the region of interest restriction
+#
+# Usage (from the repository root):
+#   python benchmarks/roi.py [frame.GIF]
+#
+# Clear-sky and full-coverage frames are made from the sample frame by
+# removing every echo or by filling every transparent pixel.
+import sys
+sys.path.insert(0, 'deployers')
+sys.path.insert(0, 'benchmarks')
+import Image
+import process
+from process_backends import best_of, FRAMES
+
+def make_samples(image):
+  clear_lut = [0 if c not in process.BORDER_COLORS else c for c in range(256)]
+  full_lut = [3 if c == 0 else c for c in range(256)]
+  return [
+    ('clear-sky', image.point(clear_lut)),
+    ('light', image),
+    ('full', image.point(full_lut))
+  ]
+
+def coverage(image):
+  frame = process.crop(image)
+  echoes = sum(1 for c in frame.getdata() if c != 0 and c not in process.BORDER_COLORS)
+  return 100.0 * echoes / (frame.size[0] * frame.size[1])
+
+def main(path):
+  failed = False
+  print "%-10s %-8s %10s %12s %12s %8s" % ("sample", "backend", "echoes(%)", "full(ms)", "roi(ms)", "speedup")
+  for name, image in make_samples(Image.open(path)):
+    for backend in sorted(process.BACKENDS):
+      full_cost, full = best_of(lambda: process.run(image, backend, roi = False))
+      roi_cost, roi = best_of(lambda: process.run(image, backend, roi = True))
+      if full != roi:
+        failed = True
+        print "%s: %s output differs with roi" % (name, backend)
+      print "%-10s %-8s %10.1f %12.1f %12.1f %7.1fx" % (name, backend, coverage(image), full_cost * 1000, roi_cost * 1000, full_cost / roi_cost)
+  if failed:
+    sys.exit(1)
+
+if __name__ == '__main__':
+  main(sys.argv[1] if len(sys.argv) > 1 else FRAMES[0])
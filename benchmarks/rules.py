@@ -0,0 +1,76 @@
+# Per-url cost of the crawler's white/black rule matching
+#
+# Usage (from the repository root):
+#   python benchmarks/rules.py
+#
+# Compares re.match over every white and black rule (the old
+# CrawlerThread.match_rule_list) with Crawler.rules, a RuleSet of both lists.
+# Links are the ones found on a station page: station menu, frame images,
+# javascript frame links and the rest of the page.
+import sys
+sys.path.insert(0, 'benchmarks')
+sys.path.insert(0, 'models')
+sys.path.insert(0, '.')
+import re
+import time
+from crawler import Crawler
+import patterns
+
+REPEAT = 20
+
+def sample_urls():
+  urls = []
+  for i in range(200):
+    urls.append('http://www.nmc.gov.cn/publish/radar/stations-%d.htm' % (i))
+  urls.append('http://www.nmc.gov.cn/publish/radar/chinaall.htm')
+  urls.append('http://www.nmc.gov.cn/publish/radar/stationindex.htm')
+  for i in range(60):
+    path = '/product/2014/201408/20140812/RDCP/SEVP_AOC_RDCP_SLDAS_EBREF_AZ9010_L88_PI_2014081210%02d00000.GIF' % (i % 60)
+    urls.append('http://image.weather.gov.cn' + path)
+    urls.append("javascript:view_text_img('radar','%s','','','','','%s','','%s','','')" % (path, path, path))
+  for i in range(100):
+    urls.append('http://www.nmc.gov.cn/publish/forecast/%d.html' % (i))
+  return urls
+
+def match_rule_list(url, rules):
+  for rule in rules:
+    if re.match(rule, url):
+      return True
+  return False
+
+def old_accepts(url, white_rules, black_rules):
+  return match_rule_list(url, white_rules) and not match_rule_list(url, black_rules)
+
+def cost_per_url(func, urls):
+  best = None
+  for i in range(REPEAT):
+    start = time.time()
+    for url in urls:
+      func(url)
+    cost = (time.time() - start) / len(urls)
+    if best == None or cost < best:
+      best = cost
+  return best
+
+def main():
+  urls = sample_urls()
+  crawlers = [
+    ('station', [patterns.STATION_RE], [patterns.STATION_INDEX_RE]),
+    ('frame', [patterns.IMG_URL_RE, patterns.IMG_ENLARGE_RE], [])
+  ]
+  failed = False
+  print "%-10s %8s %12s %12s %8s" % ("crawler", "urls", "re(us)", "ruleset(us)", "speedup")
+  for name, white_rules, black_rules in crawlers:
+    crawler = Crawler(white_rules, black_rules)
+    old = lambda url: old_accepts(url, white_rules, black_rules)
+    if [old(url) for url in urls] != [crawler.accepts(url) for url in urls]:
+      failed = True
+      print "%s: RuleSet accepts different urls" % (name)
+    old_cost = cost_per_url(old, urls)
+    new_cost = cost_per_url(crawler.accepts, urls)
+    print "%-10s %8d %12.2f %12.2f %7.1fx" % (name, len(urls), old_cost * 1e6, new_cost * 1e6, old_cost / new_cost)
+  if failed:
+    sys.exit(1)
+
+if __name__ == '__main__':
+  main()
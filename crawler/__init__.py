@@ -4,23 +4,55 @@ import urllib2
 import urlparse
 from cgi import escape
 sys.path.insert(0, 'lib')
-from bs4 import BeautifulSoup
 import logging
 import time
 import Queue
 import threading
+from urlset import UrlSet, normalize_url
+from client import FetchClient, FetchError
+from page_cache import Fingerprint, MemoryPageCache, page_digest
+from links import soup_links, strainer_links, scan_links
+from rules import RuleSet
+from retry import RetryPolicy
+from frontier import Frontier
+from event import EventEngine
 
-__all__ = ['Fetcher', 'Crawler', 'CrawlerThread']
+__all__ = ['Fetcher', 'Crawler', 'CrawlerThread', 'UrlSet', 'normalize_url', 'FetchClient', 'FetchError', 'UNCHANGED', 'MemoryPageCache', 'soup_links', 'strainer_links', 'scan_links', 'RuleSet', 'RetryPolicy', 'Frontier']
+
+# Put once per thread to make it exit
+STOP = object()
+# Walked page hasn't changed since the last crawl
+UNCHANGED = object()
 
 AGENT = "Mozilla/5.0 (Windows NT 6.1; WOW64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/36.0.1985.125 Safari/537.36"
 class Fetcher(object):
-  def __init__(self, url):
+  def __init__(self, url, client = None, cache = None, extractor = soup_links):
     self.url = url
-    self.urls = []
+    self.extractor = extractor
+    self.urls = UrlSet()
+    self.client = client
+    self.cache = cache
+    self.cached = cache.get(url) if cache else None
+    self.headers = {}
+    self.unchanged = False
+    self.content = None
 
   def __getitem__(self, x):
+    # Links seen so far
     return self.urls[x]
 
+  def __iter__(self):
+    # Links are extracted while iterating, in page order, each url once
+    if self.content == None:
+      return
+    try:
+      for href in self.extractor(self.content):
+        url = urlparse.urljoin(self.url, escape(href))
+        if self.urls.add(url):
+          yield url
+    except Exception as e:
+      logging.error("Error when parsing %s: %s" % (self.url, e))
+
   def _addHeaders(self, request):
     request.add_header("User-Agent", AGENT)
 
@@ -33,27 +65,60 @@ class Fetcher(object):
       return None
     return (request, handle)
 
+  def conditional_headers(self):
+    headers = {}
+    if self.cached:
+      if self.cached.etag:
+        headers['If-None-Match'] = self.cached.etag
+      if self.cached.last_modified:
+        headers['If-Modified-Since'] = self.cached.last_modified
+    return headers
+
+  def read(self):
+    # None if the page is not modified
+    if self.client:
+      status, self.headers, body, url = self.client.get(self.url, self.conditional_headers())
+      if status == 304 and self.cached:
+        return None
+      if status != 200:
+        raise FetchError("HTTP %d from %s" % (status, self.url))
+      return body
+    request, handle = self.open()
+    self._addHeaders(request)
+    if handle:
+      response = handle.open(request, timeout=10)
+      self.headers = dict(response.info().items())
+      return response.read()
+
+  def is_unchanged(self, body):
+    if not self.cache:
+      return False
+    if body == None:
+      return True
+    digest = page_digest(body)
+    self.cache.put(self.url, self.headers.get('etag'), self.headers.get('last-modified'), digest)
+    return self.cached != None and self.cached.digest == digest
+
+  def load(self, body):
+    # body: None if not modified
+    if self.is_unchanged(body):
+      # Same links as last time, don't parse
+      self.unchanged = True
+    elif body != None:
+      self.content = unicode(body, "utf-8", errors="replace")
+
   def fetch(self):
     try:
-      request, handle = self.open()
-      self._addHeaders(request)
-      if handle:
-        content = unicode(handle.open(request, timeout=10).read(), "utf-8",
-          errors="replace")
-        soup = BeautifulSoup(content)
-        tags = soup('a')
-        for tag in tags:
-          href = tag.get("href")
-          if href is not None:
-            url = urlparse.urljoin(self.url, escape(href))
-            if url not in self:
-              self.urls.append(url)
+      self.load(self.read())
     except Exception as e:
       logging.error("Error when fetching: %s" % (e))
       return False
     return True
 
 class CrawlerThread(threading.Thread):
+  # A walked page without links to follow is retried
+  empty_is_failure = True
+
   def __init__(self, crawler, id, max_retry = 3):
     threading.Thread.__init__(self)
     self.crawler = crawler
@@ -69,28 +134,26 @@ class CrawlerThread(threading.Thread):
   def run(self):
     crawler = self.crawler
     logging.debug("Thread %d started" % (self.id))
-    while not crawler.shouldExit:
-      if not crawler.queue.empty():
-        self.idle = False
-        task = crawler.queue.get()
-        self.current_retry = 0
-        succ = False
-        while self.current_retry <= self.max_retry:
-          if self.current_retry > 0:
-            logging.warning("Failed last time, retrying (%d/%d)" % (self.current_retry, self.max_retry))
-          # walk
-          succ = self.walk(task)
-          if succ:
-            break
-          self.current_retry += 1
-        if not succ:
-          logging.error("Fail to run %s" % (task[0]))
-          crawler.queue.task_done()
-          crawler.fail_count += 1
-        # done
-        #crawler.queue.task_done()
-        self.idle = True
-      time.sleep(1)
+    while True:
+      # Blocks until there is work, or the crawler tells us to stop
+      task = crawler.queue.get()
+      if task is STOP:
+        crawler.queue.task_done()
+        break
+      if crawler.out_of_time():
+        crawler.defer(task)
+        continue
+      self.idle = False
+      # walk, retried with backoff
+      host = urlparse.urlsplit(task[0]).netloc
+      succ = crawler.retry_policy.run(host, lambda: self.walk(task), self.max_retry, task[0])
+      if not succ:
+        logging.error("Fail to run %s" % (task[0]))
+        crawler.queue.task_done()
+        crawler.fail_count += 1
+      # done
+      #crawler.queue.task_done()
+      self.idle = True
     logging.debug("Thread %d terminated" % (self.id))
 
   def match_rule_list(self, url, rules):
@@ -103,23 +166,37 @@ class CrawlerThread(threading.Thread):
   def should_walk(self, url, urls, context):
     return True
 
-  def walk_one(self, url, context):
-    page = Fetcher(url)
+  def new_page(self, url):
+    return Fetcher(url, self.crawler.client, self.crawler.page_cache, self.crawler.link_extractor)
+
+  def fetch_page(self, url):
+    # Fetcher to iterate, UNCHANGED or None if failed
+    page = self.new_page(url)
     succ = page.fetch()
     if not succ:
       logging.error("Walk %s failed" % (url))
       return
+    if page.unchanged:
+      logging.debug("Skip unchanged %s" % (url))
+      return UNCHANGED
+    return page
+
+  def walk_one(self, url, context):
+    page = self.fetch_page(url)
+    if page == None or page is UNCHANGED:
+      return page
+    return self.walk_page(page, url, context)
+
+  def walk_page(self, page, url, context):
+    # Urls to follow from a fetched page
     # Use url as default context
     if context == None:
       context = url
     urls = []
     for i, url in enumerate(page):
       url = url.encode('utf-8')
-      in_white = self.match_rule_list(url, self.crawler.white_rules)
-      in_black = self.match_rule_list(url, self.crawler.black_rules)
       # Custom filtering
-      should_walk = self.should_walk(url, urls, context)
-      if in_white and not in_black and should_walk:
+      if self.crawler.accepts(url) and self.should_walk(url, urls, context):
         urls.append(url)
     return urls
 
@@ -129,43 +206,87 @@ class CrawlerThread(threading.Thread):
     context = task[2]
     crawler = self.crawler
     urls = self.walk_one(url, context)
-    if not urls:
+    if urls is UNCHANGED:
+      crawler.skip(url, level, context)
+      return True
+    if urls == None or (not urls and self.empty_is_failure):
       return False
     crawler.append(urls, level, context)
     return True
 
 class Crawler(object):
-  def __init__(self, white_rules, black_rules, max_level = 2, max_thread = 10, thread_klass = CrawlerThread):
+  # How hrefs are pulled out of a page, see crawler/links.py
+  link_extractor = staticmethod(soup_links)
+
+  def __init__(self, white_rules, black_rules, max_level = 2, max_thread = 10, thread_klass = CrawlerThread, normalize_urls = False, max_per_host = None, page_cache = None, engine = 'thread', max_fetch = 100, retry_policy = None, queue = None, deadline = None):
     self.white_rules = white_rules
     self.black_rules = black_rules
+    # Black rules first, a url is walked if the first rule it matches is white
+    self.rules = RuleSet(list(black_rules) + list(white_rules))
     self.max_level = max_level
-    self.urls = []
-    self._walked = []
+    self.urls = UrlSet()
+    self._walked = UrlSet()
+    # Strip fragments and sort queries, so a page is walked once
+    self.normalize_urls = normalize_urls
     self.max_thread = max_thread
     self._threads = []
-    self.queue = Queue.Queue()
+    # FIFO unless given, e.g. a Frontier
+    self.queue = queue if queue != None else Queue.Queue()
+    # time.time() after which no more pages are walked, the rest are deferred
+    self.deadline = deadline
+    self.deferred = []
     self.shouldExit = False
     self._thread_klass = thread_klass
     self.fail_count = 0
+    # 'thread': max_thread threads fetch pages with blocking calls
+    # 'event': one thread runs up to max_fetch fetches at once, see crawler/event.py
+    self.engine = engine
+    self.max_fetch = max_fetch
+    # Shared by all threads, at most max_per_host requests to a host at once
+    if max_per_host == None:
+      max_per_host = max_fetch if engine == 'event' else max_thread
+    self.client = FetchClient(max_per_host, agent = AGENT)
+    # Backoff, budget and breaker for retried walks
+    self.retry_policy = retry_policy or RetryPolicy(name = 'crawler')
+    # Fingerprints of walked pages, unchanged pages are not parsed again
+    self.page_cache = page_cache
+    self.unchanged_count = 0
 
   def append(self, urls, level, context = None):
+    if self.normalize_urls:
+      urls = [normalize_url(url) for url in urls]
     # Append results
     for url in urls:
-      if url not in self.urls:
-        self.urls.append(url)
+      self.urls.add(url)
     # TODO: custom append
     self.on_append(urls, level, context)
     # Append queue
     if level < self.max_level:
       next_level = level + 1
       for url in urls:
-        if url not in self._walked:
+        if self._walked.add(url):
           self.queue.put((url, next_level, context))
-          self._walked.append(url)
     if level != 0:
       self.queue.task_done()
     pass
 
+  def accepts(self, url):
+    index = self.rules.match(url)
+    return index != None and index >= len(self.black_rules)
+
+  def out_of_time(self):
+    return self.deadline != None and time.time() >= self.deadline
+
+  def defer(self, task):
+    # Not walked for lack of time
+    self.deferred.append(task)
+    self.queue.task_done()
+
+  def skip(self, url, level, context = None):
+    self.unchanged_count += 1
+    if level != 0:
+      self.queue.task_done()
+
   def on_append(self, urls, level, context = None):
     pass
 
@@ -175,32 +296,47 @@ class Crawler(object):
       self._threads.append(t)
       t.start()
 
-  def walk(self, urls):
-    # Create threads to size
-    self._init_threads()
-    self.append(urls, 0)
-    # Wait
-    self.queue.join()
+  def _stop_threads(self):
     # Notify threads to exit
     self.shouldExit = True
+    for t in self._threads:
+      self.queue.put(STOP)
     # Wait
     for t in self._threads:
       t.join()
 
+  def _run(self, seed):
+    # seed: appends the first urls
+    if self.engine == 'event':
+      EventEngine(self).run(seed)
+    else:
+      # Create threads to size
+      self._init_threads()
+      seed()
+      # Wait
+      self.queue.join()
+      self._stop_threads()
+    self.client.close()
+    self.client.log_stats()
+    self.retry_policy.log_stats()
+    if self.deferred:
+      logging.warning("Out of time, %d pages deferred" % (len(self.deferred)))
+    if self.page_cache:
+      logging.info("%d pages unchanged since last crawl" % (self.unchanged_count))
+
+  def walk(self, urls):
+    self._run(lambda: self.append(urls, 0))
+
   def walk_with_context(self, tasks):
     # Tasks = [(url, context), ...]
-    self._init_threads()
-    for task in tasks:
-      url = task[0]
-      context = task[1]
-      self.append([url], 0, context)
-    # Wait
-    self.queue.join()
-    # Notify threads to exit
-    self.shouldExit = True
-    # Wait
-    for t in self._threads:
-      t.join()
+    if self.page_cache:
+      self.page_cache.load([task[0] for task in tasks])
+    def seed():
+      for task in tasks:
+        url = task[0]
+        context = task[1]
+        self.append([url], 0, context)
+    self._run(seed)
 
 def main():
   url = 'http://www.nmc.gov.cn/publish/radar/beijing.htm'
@@ -0,0 +1,158 @@
+import httplib
+import logging
+import threading
+import time
+import urlparse
+import zlib
+
+__all__ = ['FetchClient', 'FetchError']
+
+MAX_REDIRECTS = 5
+
+class FetchError(IOError):
+  pass
+
+def decode_body(body, encoding):
+  if encoding == 'gzip':
+    return zlib.decompress(body, 16 + zlib.MAX_WBITS)
+  if encoding == 'deflate':
+    try:
+      return zlib.decompress(body)
+    except zlib.error:
+      # Some servers send raw deflate without the zlib header
+      return zlib.decompress(body, -zlib.MAX_WBITS)
+  return body
+
+def percentile(values, p):
+  # values: sorted
+  if not values:
+    return 0
+  return values[min(int(len(values) * p / 100.0), len(values) - 1)]
+
+# Shared by all threads of a crawler: keeps connections alive per host, asks
+# for compressed pages and caps how many requests go to one host at a time.
+class FetchClient(object):
+  def __init__(self, max_per_host = 10, timeout = 10, agent = None):
+    self.max_per_host = max_per_host
+    self.timeout = timeout
+    self.agent = agent
+    self._lock = threading.Lock()
+    # (scheme, host) -> idle connections
+    self._idle = {}
+    # (scheme, host) -> semaphore
+    self._slots = {}
+    # Stats
+    self.requests = 0
+    self.connections = 0
+    self.reuses = 0
+    self.bytes = 0
+    self.decoded_bytes = 0
+    self._latencies = []
+
+  def _slot(self, key):
+    with self._lock:
+      if key not in self._slots:
+        self._slots[key] = threading.BoundedSemaphore(self.max_per_host)
+      return self._slots[key]
+
+  def _acquire(self, key):
+    with self._lock:
+      idle = self._idle.get(key)
+      if idle:
+        return idle.pop(), True
+    klass = httplib.HTTPSConnection if key[0] == 'https' else httplib.HTTPConnection
+    return klass(key[1], timeout = self.timeout), False
+
+  def _release(self, key, cnx):
+    with self._lock:
+      self._idle.setdefault(key, []).append(cnx)
+
+  def _request_once(self, key, path, headers):
+    cnx, reused = self._acquire(key)
+    try:
+      cnx.request('GET', path, None, headers)
+      response = cnx.getresponse()
+      body = response.read()
+    except (httplib.HTTPException, IOError):
+      cnx.close()
+      if reused:
+        # Server closed the idle socket, the caller tries another one
+        return None
+      raise
+    with self._lock:
+      self.connections += 0 if reused else 1
+      self.reuses += 1 if reused else 0
+    if response.getheader('connection', '').lower() == 'close' or response.will_close:
+      cnx.close()
+    else:
+      self._release(key, cnx)
+    return response, body
+
+  def get(self, url, headers = None):
+    # Returns (status, headers, decoded body, final url)
+    start = time.time()
+    for i in range(MAX_REDIRECTS + 1):
+      parts = urlparse.urlsplit(url)
+      if parts.scheme not in ('http', 'https'):
+        raise FetchError("Unsupported url %s" % (url))
+      key = (parts.scheme, parts.netloc)
+      path = urlparse.urlunsplit(('', '', parts.path or '/', parts.query, ''))
+      request_headers = {'Accept-Encoding': 'gzip, deflate'}
+      if self.agent:
+        request_headers['User-Agent'] = self.agent
+      if headers:
+        request_headers.update(headers)
+      slot = self._slot(key)
+      with slot:
+        result = None
+        # Only a reused connection gives None, and every try uses one up,
+        # so this ends with a new connection at the latest
+        while result == None:
+          result = self._request_once(key, path, request_headers)
+      response, body = result
+      location = response.getheader('location')
+      if response.status in (301, 302, 303, 307) and location:
+        url = urlparse.urljoin(url, location)
+        continue
+      response_headers = dict(response.getheaders())
+      decoded = decode_body(body, response.getheader('content-encoding', '').lower())
+      self.record(len(body), len(decoded), time.time() - start)
+      return response.status, response_headers, decoded, url
+    raise FetchError("Too many redirects from %s" % (url))
+
+  def record(self, size, decoded_size, latency, connections = 0):
+    # One page fetched, connections: opened for it by someone else
+    with self._lock:
+      self.requests += 1
+      self.bytes += size
+      self.decoded_bytes += decoded_size
+      self.connections += connections
+      self._latencies.append(latency)
+
+  def close(self):
+    with self._lock:
+      for idle in self._idle.itervalues():
+        for cnx in idle:
+          cnx.close()
+      self._idle = {}
+
+  @property
+  def stats(self):
+    with self._lock:
+      latencies = sorted(self._latencies)
+      opened = self.connections + self.reuses
+      return {
+        'requests': self.requests,
+        'connections': self.connections,
+        'reuses': self.reuses,
+        'reuse_rate': 100.0 * self.reuses / opened if opened else 0,
+        'bytes': self.bytes,
+        'decoded_bytes': self.decoded_bytes,
+        'p50': percentile(latencies, 50) * 1000,
+        'p90': percentile(latencies, 90) * 1000,
+        'p99': percentile(latencies, 99) * 1000
+      }
+
+  def log_stats(self):
+    logging.info("Fetched %(requests)d pages over %(connections)d connections (%(reuse_rate).1f%% reused), "
+      "%(bytes)d bytes (%(decoded_bytes)d decoded), latency p50 %(p50).0fms p90 %(p90).0fms p99 %(p99).0fms" % self.stats)
@@ -0,0 +1,305 @@
+import errno
+import logging
+import select
+import socket
+import time
+import urlparse
+import Queue
+from collections import deque
+from client import decode_body, MAX_REDIRECTS
+
+__all__ = ['EventEngine']
+
+# Crawl engine running every fetch on one thread with non-blocking sockets and
+# select(), instead of one blocking fetch per CrawlerThread. Pages are filtered
+# by an instance of the crawler's thread class (never started), so should_walk
+# and walk_page work the same with both engines.
+#
+# Only plain http, one connection per fetch (Connection: close).
+
+READ_SIZE = 64 * 1024
+
+class FetchTask(object):
+  def __init__(self, task, retry = 0):
+    # task: (url, level, context) from the crawler queue
+    self.task = task
+    self.retry = retry
+    self.url = task[0]
+    self.redirects = 0
+    self.page = None
+    self.sock = None
+    self.host = None
+    self.out = ''
+    self.data = []
+    self.size = 0
+    self.connected = False
+    self.start = None
+    self.deadline = None
+    # Backing off or throttled until then
+    self.not_before = 0
+    self.throttled = False
+
+def parse_response(raw):
+  # Returns (status, headers, body)
+  head, sep, body = raw.partition('\r\n\r\n')
+  if not sep:
+    raise IOError("Incomplete response")
+  lines = head.split('\r\n')
+  status = int(lines[0].split(' ', 2)[1])
+  headers = {}
+  for line in lines[1:]:
+    name, sep, value = line.partition(':')
+    if sep:
+      headers[name.strip().lower()] = value.strip()
+  if headers.get('transfer-encoding', '').lower() == 'chunked':
+    body = dechunk(body)
+  return status, headers, body
+
+def dechunk(body):
+  chunks = []
+  pos = 0
+  while True:
+    end = body.index('\r\n', pos)
+    size = int(body[pos:end].split(';')[0], 16)
+    if size == 0:
+      return ''.join(chunks)
+    chunks.append(body[end + 2:end + 2 + size])
+    pos = end + 2 + size + 2
+
+class EventEngine(object):
+  def __init__(self, crawler, timeout = 10):
+    self.crawler = crawler
+    self.client = crawler.client
+    self.max_fetch = crawler.max_fetch
+    self.max_per_host = self.client.max_per_host
+    self.timeout = timeout
+    self.policy = crawler.retry_policy
+    # Filters pages with the hooks of the crawler's thread class
+    self.walker = crawler._thread_klass(crawler, 0)
+    # socket -> FetchTask
+    self.active = {}
+    # host -> fetches in flight
+    self.per_host = {}
+    # Fetches waiting for a slot of their host, or to be retried
+    self.waiting = deque()
+    self._addresses = {}
+
+  def run(self, seed):
+    seed()
+    while True:
+      self._start_fetches()
+      if not self.active:
+        if not self.waiting and self.crawler.queue.empty():
+          break
+        # Only fetches backing off are left
+        time.sleep(self._time_to_wait(1))
+        continue
+      readers = [sock for sock, fetch in self.active.iteritems() if fetch.connected and not fetch.out]
+      writers = [sock for sock, fetch in self.active.iteritems() if not fetch.connected or fetch.out]
+      readable, writable, failed = select.select(readers, writers, [], self._time_to_wait(1))
+      for sock in writable:
+        self._on_writable(self.active.get(sock))
+      for sock in readable:
+        self._on_readable(self.active.get(sock))
+      self._check_timeouts()
+
+  def _time_to_wait(self, limit):
+    # Fetches waiting for a free slot only start once another fetch is done,
+    # which select() wakes up for
+    if len(self.active) >= self.max_fetch:
+      return limit
+    now = time.time()
+    waits = [limit]
+    for fetch in self.waiting:
+      if self.per_host.get(self._host_of(fetch.url), 0) < self.max_per_host:
+        waits.append(fetch.not_before - now)
+    return max(min(waits), 0)
+
+  def _next_task(self):
+    # Waiting fetches first, then the crawler queue
+    now = time.time()
+    for i in range(len(self.waiting)):
+      fetch = self.waiting.popleft()
+      if self.crawler.out_of_time():
+        self.crawler.defer(fetch.task)
+        continue
+      if fetch.not_before <= now and self.per_host.get(self._host_of(fetch.url), 0) < self.max_per_host:
+        return fetch
+      self.waiting.append(fetch)
+    while True:
+      try:
+        task = self.crawler.queue.get_nowait()
+      except Queue.Empty:
+        return None
+      if self.crawler.out_of_time():
+        self.crawler.defer(task)
+        continue
+      fetch = FetchTask(task)
+      if self.per_host.get(self._host_of(fetch.url), 0) < self.max_per_host:
+        return fetch
+      self.waiting.append(fetch)
+
+  def _host_of(self, url):
+    return urlparse.urlsplit(url).netloc
+
+  def _start_fetches(self):
+    while len(self.active) < self.max_fetch:
+      fetch = self._next_task()
+      if fetch == None:
+        return
+      host = self._host_of(fetch.url)
+      if not fetch.throttled:
+        fetch.throttled = True
+        wait = self.policy.reserve(host)
+        if wait > 0:
+          fetch.not_before = time.time() + wait
+          self.waiting.append(fetch)
+          continue
+      if not self.policy.allow(host):
+        self._give_up(fetch, IOError("%s is failing" % (host)))
+        continue
+      if fetch.page == None:
+        fetch.page = self.walker.new_page(fetch.url)
+        fetch.start = time.time()
+      try:
+        self._connect(fetch)
+      except (socket.error, IOError) as e:
+        self._fail(fetch, e)
+
+  def _connect(self, fetch):
+    parts = urlparse.urlsplit(fetch.url)
+    if parts.scheme != 'http':
+      raise IOError("Unsupported url %s" % (fetch.url))
+    host = parts.hostname
+    port = parts.port or 80
+    address = self._addresses.get((host, port))
+    if address == None:
+      address = socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM)[0]
+      self._addresses[(host, port)] = address
+    sock = socket.socket(address[0], address[1], address[2])
+    sock.setblocking(0)
+    err = sock.connect_ex(address[4])
+    if err not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK):
+      sock.close()
+      raise socket.error(err, errno.errorcode.get(err, str(err)))
+    path = urlparse.urlunsplit(('', '', parts.path or '/', parts.query, ''))
+    headers = {'Host': parts.netloc, 'Accept-Encoding': 'gzip, deflate', 'Connection': 'close'}
+    if self.client.agent:
+      headers['User-Agent'] = self.client.agent
+    headers.update(fetch.page.conditional_headers())
+    fetch.out = 'GET %s HTTP/1.1\r\n%s\r\n' % (path, ''.join('%s: %s\r\n' % h for h in headers.iteritems()))
+    fetch.sock = sock
+    fetch.host = parts.netloc
+    fetch.connected = False
+    fetch.data = []
+    fetch.size = 0
+    fetch.deadline = time.time() + self.timeout
+    self.per_host[fetch.host] = self.per_host.get(fetch.host, 0) + 1
+    self.active[sock] = fetch
+
+  def _on_writable(self, fetch):
+    if fetch == None:
+      return
+    try:
+      if not fetch.connected:
+        err = fetch.sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+        if err:
+          raise socket.error(err, errno.errorcode.get(err, str(err)))
+        fetch.connected = True
+      sent = fetch.sock.send(fetch.out)
+      fetch.out = fetch.out[sent:]
+    except socket.error as e:
+      if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+        return
+      self._close(fetch)
+      self._fail(fetch, e)
+
+  def _on_readable(self, fetch):
+    if fetch == None:
+      return
+    try:
+      data = fetch.sock.recv(READ_SIZE)
+    except socket.error as e:
+      if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+        return
+      self._close(fetch)
+      self._fail(fetch, e)
+      return
+    if data:
+      fetch.data.append(data)
+      fetch.size += len(data)
+      return
+    # Server closed, response is complete
+    self._close(fetch)
+    try:
+      status, headers, body = parse_response(''.join(fetch.data))
+      self._on_response(fetch, status, headers, body)
+    except Exception as e:
+      self._fail(fetch, e)
+
+  def _check_timeouts(self):
+    now = time.time()
+    for fetch in [f for f in self.active.itervalues() if f.deadline < now]:
+      self._close(fetch)
+      self._fail(fetch, IOError("Timed out"))
+
+  def _close(self, fetch):
+    self.active.pop(fetch.sock, None)
+    self.per_host[fetch.host] -= 1
+    fetch.sock.close()
+
+  def _on_response(self, fetch, status, headers, body):
+    location = headers.get('location')
+    if status in (301, 302, 303, 307) and location:
+      if fetch.redirects >= MAX_REDIRECTS:
+        raise IOError("Too many redirects from %s" % (fetch.task[0]))
+      fetch.redirects += 1
+      fetch.url = urlparse.urljoin(fetch.url, location)
+      self.waiting.append(fetch)
+      return
+    page = fetch.page
+    page.headers = headers
+    decoded = None
+    if status == 304 and page.cached:
+      page.load(None)
+    elif status == 200:
+      decoded = decode_body(body, headers.get('content-encoding', '').lower())
+      page.load(decoded)
+    else:
+      raise IOError("HTTP %d from %s" % (status, fetch.url))
+    self.client.record(fetch.size, len(decoded or ''), time.time() - fetch.start, fetch.redirects + 1)
+    self._walk(fetch)
+
+  def _walk(self, fetch):
+    crawler = self.crawler
+    url, level, context = fetch.task
+    page = fetch.page
+    if page.unchanged:
+      logging.debug("Skip unchanged %s" % (url))
+      crawler.skip(url, level, context)
+      return
+    urls = self.walker.walk_page(page, url, context)
+    if urls == None or (not urls and self.walker.empty_is_failure):
+      self._fail(fetch, IOError("No urls to walk"))
+      return
+    self.policy.record(self._host_of(fetch.url), True)
+    crawler.append(urls, level, context)
+
+  def _fail(self, fetch, e):
+    url = fetch.task[0]
+    host = self._host_of(fetch.url)
+    self.policy.record(host, False)
+    delay = self.policy.retry_delay(host, fetch.retry + 1, self.walker.max_retry)
+    if delay != None:
+      logging.warning("Walk %s failed: %s, retrying (%d/%d)" % (url, e, fetch.retry + 1, self.walker.max_retry))
+      retry = FetchTask(fetch.task, fetch.retry + 1)
+      retry.not_before = time.time() + delay
+      self.waiting.append(retry)
+      return
+    self._give_up(fetch, e)
+
+  def _give_up(self, fetch, e):
+    url = fetch.task[0]
+    logging.error("Fail to run %s: %s" % (url, e))
+    self.crawler.fail_count += 1
+    self.crawler.queue.task_done()
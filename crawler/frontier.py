@@ -0,0 +1,48 @@
+import heapq
+import Queue
+
+__all__ = ['Frontier']
+
+# Crawler queue that hands out the task with the lowest key(task) first, ties in
+# put order. With a limit, the highest keyed task is dropped once it is full,
+# put() never blocks.
+class Frontier(Queue.Queue):
+  def __init__(self, key, limit = 0):
+    self.key = key
+    self.limit = limit
+    # Tasks that didn't fit
+    self.dropped = []
+    Queue.Queue.__init__(self)
+
+  def _init(self, maxsize):
+    self.queue = []
+    self._count = 0
+
+  def _qsize(self, len = len):
+    return len(self.queue)
+
+  def _priority(self, item):
+    if not isinstance(item, tuple):
+      # Stop markers and such go first
+      return float('-inf')
+    return self.key(item)
+
+  def _put(self, item):
+    entry = (self._priority(item), self._count, item)
+    self._count += 1
+    if self.limit and len(self.queue) >= self.limit:
+      worst = max(self.queue)
+      if entry < worst:
+        self.queue.remove(worst)
+        heapq.heapify(self.queue)
+        heapq.heappush(self.queue, entry)
+      else:
+        worst = entry
+      self.dropped.append(worst[2])
+      # put() counts the task as unfinished next, it never will be
+      self.unfinished_tasks -= 1
+      return
+    heapq.heappush(self.queue, entry)
+
+  def _get(self):
+    return heapq.heappop(self.queue)[2]
@@ -0,0 +1,60 @@
+import sys
+import logging
+from HTMLParser import HTMLParser, HTMLParseError
+sys.path.insert(0, 'lib')
+from bs4 import BeautifulSoup, SoupStrainer
+
+__all__ = ['soup_links', 'strainer_links', 'scan_links']
+
+# Link extractors take the decoded page and yield the href of every <a>.
+# Crawler.link_extractor picks one for a crawler class.
+
+def soup_links(content):
+  # Whole document tree, then every <a>
+  soup = BeautifulSoup(content)
+  for tag in soup('a'):
+    href = tag.get('href')
+    if href is not None:
+      yield href
+
+def strainer_links(content):
+  # Tree of <a> tags only
+  soup = BeautifulSoup(content, parse_only = SoupStrainer('a'))
+  for tag in soup('a'):
+    href = tag.get('href')
+    if href is not None:
+      yield href
+
+class LinkScanner(HTMLParser):
+  def __init__(self):
+    HTMLParser.__init__(self)
+    self.links = []
+
+  def handle_starttag(self, tag, attrs):
+    if tag != 'a':
+      return
+    for name, value in attrs:
+      if name == 'href' and value is not None:
+        self.links.append(value)
+        return
+
+SCAN_CHUNK_SIZE = 16 * 1024
+
+def scan_links(content, chunk_size = SCAN_CHUNK_SIZE):
+  # No tree at all, links are yielded as the page is scanned
+  scanner = LinkScanner()
+  try:
+    for start in xrange(0, len(content), chunk_size):
+      scanner.feed(content[start:start + chunk_size])
+      for href in scanner.links:
+        yield href
+      scanner.links = []
+    scanner.close()
+  except HTMLParseError as e:
+    # Broken markup, let bs4 deal with it. Links seen twice are deduped later
+    logging.warning("Fail to scan links: %s" % (e))
+    for href in strainer_links(content):
+      yield href
+    return
+  for href in scanner.links:
+    yield href
@@ -0,0 +1,47 @@
+import hashlib
+import threading
+from collections import namedtuple
+
+__all__ = ['Fingerprint', 'MemoryPageCache', 'page_digest']
+
+# What a page looked like last time: validators for conditional requests and a
+# hash of the body for servers that don't send them
+Fingerprint = namedtuple('Fingerprint', ['etag', 'last_modified', 'digest'])
+
+def page_digest(body):
+  return hashlib.sha1(body).hexdigest()
+
+# Fingerprints of crawled pages, url -> Fingerprint.
+# New fingerprints are only kept after commit(), so that a page whose frames
+# didn't make it is parsed again next time.
+class MemoryPageCache(object):
+  def __init__(self):
+    self._pages = {}
+    self._pending = {}
+    self._lock = threading.Lock()
+
+  def load(self, urls):
+    # Called before a crawl with the urls it will fetch
+    pass
+
+  def get(self, url):
+    return self._pages.get(url)
+
+  def put(self, url, etag, last_modified, digest):
+    with self._lock:
+      self._pending[url] = Fingerprint(etag, last_modified, digest)
+
+  def commit(self, urls = None):
+    # Only the pages of urls, others are fetched and walked again next time
+    with self._lock:
+      pending = self._pending
+      self._pending = {}
+    if urls != None:
+      urls = set(urls)
+      pending = dict((url, fp) for url, fp in pending.iteritems() if url in urls)
+    self.save(pending)
+    self._pages.update(pending)
+    return len(pending)
+
+  def save(self, pages):
+    pass
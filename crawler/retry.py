@@ -0,0 +1,186 @@
+import logging
+import random
+import threading
+import time
+
+__all__ = ['RetryPolicy', 'TokenBucket', 'CircuitBreaker']
+
+class TokenBucket(object):
+  # rate requests per second, up to burst at once
+  def __init__(self, rate, burst):
+    self.rate = float(rate)
+    self.burst = burst
+    self.tokens = float(burst)
+    self.updated = time.time()
+
+  def take(self, now):
+    # Seconds to wait before the request, the token is taken either way
+    self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+    self.updated = now
+    self.tokens -= 1
+    if self.tokens >= 0:
+      return 0
+    return -self.tokens / self.rate
+
+class CircuitBreaker(object):
+  # Opens after threshold failures in a row, lets one request through after reset_time
+  def __init__(self, threshold, reset_time):
+    self.threshold = threshold
+    self.reset_time = reset_time
+    self.failures = 0
+    self.opened = None
+
+  def allow(self, now):
+    if self.opened == None:
+      return True
+    if now - self.opened >= self.reset_time:
+      # Half open, the next result decides
+      self.opened = now
+      return True
+    return False
+
+  def record(self, succ, now):
+    # True if the breaker trips
+    if succ:
+      self.failures = 0
+      self.opened = None
+      return False
+    self.failures += 1
+    if self.failures >= self.threshold and self.opened == None:
+      self.opened = now
+      return True
+    if self.opened != None:
+      self.opened = now
+    return False
+
+# Shared by everything retrying requests to the same hosts: exponential backoff
+# with full jitter, a retry budget (retries allowed per attempt made), a token
+# bucket and a circuit breaker per host.
+class RetryPolicy(object):
+  def __init__(self, base_delay = 0.5, max_delay = 30, budget_ratio = 0.2, budget_min = 10,
+               rate = None, burst = 10, breaker_threshold = 10, breaker_reset = 30, name = 'retry'):
+    self.base_delay = base_delay
+    self.max_delay = max_delay
+    self.budget_ratio = budget_ratio
+    self.budget_min = budget_min
+    self.rate = rate
+    self.burst = burst
+    self.breaker_threshold = breaker_threshold
+    self.breaker_reset = breaker_reset
+    self.name = name
+    self._lock = threading.Lock()
+    self._buckets = {}
+    self._breakers = {}
+    # Metrics
+    self.attempts = 0
+    self.retries = 0
+    self.budget_exhausted = 0
+    self.trips = 0
+    self.rejected = 0
+    self.backoff_time = 0.0
+    self.throttle_time = 0.0
+
+  def _breaker(self, host):
+    if host not in self._breakers:
+      self._breakers[host] = CircuitBreaker(self.breaker_threshold, self.breaker_reset)
+    return self._breakers[host]
+
+  def delay(self, retry):
+    # Before the retry-th retry, starting at 1
+    return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** (retry - 1))))
+
+  def allow(self, host):
+    # False while the breaker of host is open
+    with self._lock:
+      if self._breaker(host).allow(time.time()):
+        return True
+      self.rejected += 1
+      return False
+
+  def reserve(self, host):
+    # Seconds to wait before the next request to host
+    if not self.rate:
+      return 0
+    with self._lock:
+      if host not in self._buckets:
+        self._buckets[host] = TokenBucket(self.rate, self.burst)
+      wait = self._buckets[host].take(time.time())
+      self.throttle_time += wait
+      return wait
+
+  def throttle(self, host):
+    wait = self.reserve(host)
+    if wait > 0:
+      time.sleep(wait)
+
+  def record(self, host, succ):
+    with self._lock:
+      self.attempts += 1
+      if self._breaker(host).record(succ, time.time()):
+        self.trips += 1
+        logging.warning("%s: too many failures on %s, stop for %ds" % (self.name, host, self.breaker_reset))
+
+  def retry_delay(self, host, retry, max_retry):
+    # Seconds to wait before the retry-th retry, or None if it shouldn't be made
+    if retry > max_retry:
+      return None
+    with self._lock:
+      breaker = self._breaker(host)
+      if breaker.opened != None and time.time() - breaker.opened < breaker.reset_time:
+        self.rejected += 1
+        return None
+      if self.retries >= self.budget_min + self.budget_ratio * self.attempts:
+        self.budget_exhausted += 1
+        return None
+      self.retries += 1
+      delay = self.delay(retry)
+      self.backoff_time += delay
+      return delay
+
+  def backoff(self, host, retry, max_retry):
+    # Sleeps before a retry, False if it shouldn't be made
+    delay = self.retry_delay(host, retry, max_retry)
+    if delay == None:
+      return False
+    time.sleep(delay)
+    return True
+
+  def run(self, host, func, max_retry, describe = None):
+    # Calls func() until it returns a true value, returns the last result
+    retry = 0
+    result = None
+    while True:
+      if not self.allow(host):
+        logging.error("%s: %s is failing, skip %s" % (self.name, host, describe or 'request'))
+        return result
+      self.throttle(host)
+      try:
+        result = func()
+      except Exception as e:
+        logging.error("Error: %s" % (e))
+        result = None
+      self.record(host, bool(result))
+      if result:
+        return result
+      retry += 1
+      if not self.backoff(host, retry, max_retry):
+        return result
+      logging.warning("Failed last time, retrying (%d/%d)" % (retry, max_retry))
+
+  @property
+  def stats(self):
+    with self._lock:
+      return {
+        'name': self.name,
+        'attempts': self.attempts,
+        'retries': self.retries,
+        'budget_exhausted': self.budget_exhausted,
+        'trips': self.trips,
+        'rejected': self.rejected,
+        'backoff_time': self.backoff_time,
+        'throttle_time': self.throttle_time
+      }
+
+  def log_stats(self):
+    logging.info("%(name)s: %(attempts)d attempts, %(retries)d retries (%(budget_exhausted)d over budget), "
+      "%(trips)d breaker trips, %(rejected)d rejected, %(backoff_time).1fs backing off, %(throttle_time).1fs throttled" % self.stats)
@@ -0,0 +1,45 @@
+import re
+
+__all__ = ['RuleSet']
+
+# Regex rules compiled once into a single alternation. A url is matched against
+# all rules in one pass, the first rule (in order) that matches wins, the same
+# as trying re.match with every rule in turn.
+class RuleSet(object):
+  def __init__(self, rules):
+    self.rules = list(rules)
+    self.patterns = [re.compile(rule) for rule in self.rules]
+    # Rule i is wrapped in group _offsets[i], its own groups follow
+    self._offsets = []
+    parts = []
+    group = 1
+    for pattern in self.patterns:
+      self._offsets.append(group)
+      parts.append('(%s)' % (pattern.pattern))
+      group += pattern.groups + 1
+    self._rule_of_group = dict((offset, i) for i, offset in enumerate(self._offsets))
+    self._combined = re.compile('|'.join(parts)) if parts else None
+
+  def __len__(self):
+    return len(self.rules)
+
+  def _match(self, url):
+    if not self._combined:
+      return None, None
+    m = self._combined.match(url)
+    if not m:
+      return None, None
+    # The rule's group encloses all of its own, so it is closed last
+    return self._rule_of_group[m.lastindex], m
+
+  def match(self, url):
+    # Index of the first matching rule, or None
+    return self._match(url)[0]
+
+  def match_groups(self, url):
+    # (index, groups of that rule), or (None, None)
+    index, m = self._match(url)
+    if index == None:
+      return None, None
+    offset = self._offsets[index]
+    return index, m.groups()[offset:offset + self.patterns[index].groups]
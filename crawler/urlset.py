@@ -0,0 +1,47 @@
+import threading
+import urlparse
+
+__all__ = ['UrlSet', 'normalize_url']
+
+def normalize_url(url):
+  # Same page, same url: lower case scheme and host, no fragment, sorted query
+  parts = urlparse.urlsplit(url)
+  if parts.scheme not in ('http', 'https'):
+    # e.g. javascript: links of frames, leave them alone
+    return url
+  query = '&'.join(sorted(q for q in parts.query.split('&') if q))
+  return urlparse.urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path or '/', query, ''))
+
+# Ordered set of urls, safe to share between crawler threads.
+# Membership is O(1), iteration follows insertion order.
+class UrlSet(object):
+  def __init__(self, urls = None):
+    self._order = []
+    self._seen = set()
+    self._lock = threading.Lock()
+    if urls:
+      for url in urls:
+        self.add(url)
+
+  def add(self, url):
+    # Returns True if url is new, checked and added at once
+    with self._lock:
+      if url in self._seen:
+        return False
+      self._seen.add(url)
+      self._order.append(url)
+      return True
+
+  def __contains__(self, url):
+    return url in self._seen
+
+  def __len__(self):
+    return len(self._order)
+
+  def __getitem__(self, x):
+    return self._order[x]
+
+  def __iter__(self):
+    # Snapshot, other threads may still be adding
+    with self._lock:
+      return iter(list(self._order))
@@ -0,0 +1,116 @@
+import sys
+sys.path.insert(0, 'lib')
+from lib.github import Github
+import github.Repository
+import logging
+import threading
+import time
+
+# Requests a frame deploy makes besides blobs:
+# per station: frames.json blob + tree
+# per run: root tree, new root, parent commit, commit, ref
+REQUESTS_PER_STATION = 2
+REQUESTS_PER_COMMIT = 5
+
+def estimate_frame_requests(station_count):
+  return station_count * REQUESTS_PER_STATION + REQUESTS_PER_COMMIT
+
+class Account(object):
+  def __init__(self, username, password):
+    self.username = username
+    self.g = Github(username, password)
+    self.remaining = -1
+    self.limit = -1
+    self.reset_time = 0
+    # Calls promised to someone but not made yet
+    self.reserved = 0
+    self.repo = None
+    self.repo_url = None
+
+  def bind(self, repo_url):
+    if self.repo_url == repo_url:
+      return
+    requester = self.g.get_user()._requester
+    self.repo = github.Repository.Repository(requester, {}, {"url": repo_url}, completed = False)
+    self.repo_url = repo_url
+
+  def is_stale(self):
+    return self.remaining < 0 or time.time() >= self.reset_time
+
+  def refresh(self):
+    try:
+      self.g.get_rate_limit()
+      self.update()
+    except Exception as e:
+      logging.error("Fail to read rate of %s: %s" % (self.username, e))
+      # Don't schedule anything on an account we can't use
+      self.remaining = 0
+      self.reset_time = time.time() + 60
+
+  def update(self):
+    # Requester keeps the rate from headers of the last response
+    rate = self.g.rate_limiting
+    self.remaining = rate[0]
+    self.limit = rate[1]
+    self.reset_time = self.g.rate_limiting_resettime
+
+  def available(self, threshold):
+    return self.remaining - self.reserved - threshold
+
+# Spreads API calls over every account in config.ACCOUNTS by remaining rate.
+# Rates are refreshed from response headers after each call, and only read with
+# /rate_limit (which is free) when unknown or past the reset time.
+class AccountScheduler(object):
+  def __init__(self, accounts, threshold = 100):
+    self.accounts = [Account(a[0], a[1]) for a in accounts]
+    self.threshold = threshold
+    self._lock = threading.Lock()
+
+  def get(self, username):
+    for account in self.accounts:
+      if account.username == username:
+        return account
+
+  def prepare(self, repo_url):
+    for account in self.accounts:
+      account.bind(repo_url)
+      if account.is_stale():
+        account.refresh()
+      logging.info("Account %s, rate: (%d/%d)" % (account.username, account.remaining, account.limit))
+
+  def reserve(self, username, count):
+    # Returns the reservation to give back to finish()
+    account = self.get(username)
+    if not account:
+      return None
+    with self._lock:
+      account.reserved += count
+    return (account, count)
+
+  def budget(self):
+    with self._lock:
+      return sum(max(account.available(self.threshold), 0) for account in self.accounts)
+
+  def fits(self, count):
+    return count <= self.budget()
+
+  def acquire(self):
+    with self._lock:
+      best = max(self.accounts, key = lambda a: a.available(self.threshold))
+      if best.available(self.threshold) <= 0:
+        return None
+      best.reserved += 1
+      return best
+
+  def release(self, account):
+    with self._lock:
+      account.reserved -= 1
+      account.update()
+
+  def finish(self, reservations):
+    # Only what this deploy reserved, others may be running on the same accounts
+    with self._lock:
+      for account, count in reservations:
+        account.reserved -= count
+      for account in self.accounts:
+        logging.info("Account %s, rate: (%d/%d)" % (account.username, account.remaining, account.limit))
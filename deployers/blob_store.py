@@ -0,0 +1,84 @@
+try:
+  from google.appengine.ext import ndb
+except ImportError:
+  ndb = None
+import hashlib
+import logging
+import threading
+
+# SHAs of the blobs already committed to the repository. Frames are content
+# addressed like git does, so an image that was pushed before (clear sky, or a
+# frame crawled again) goes into the tree by its SHA without being uploaded
+# again. Only blobs reachable from a commit are added, others may be garbage
+# collected by GitHub.
+
+def git_blob_sha(data):
+  # What git (and GitHub) names a blob with this content
+  sha = hashlib.sha1("blob %d\0" % (len(data)))
+  sha.update(data)
+  return sha.hexdigest()
+
+class MemoryBlobStore(object):
+  def __init__(self):
+    self._shas = set()
+    self._lock = threading.Lock()
+
+  def contains(self, sha):
+    with self._lock:
+      return sha in self._shas
+
+  def load(self):
+    # Everything is in memory already
+    pass
+
+  def add_multi(self, shas):
+    with self._lock:
+      self._shas.update(shas)
+
+  def clear(self):
+    with self._lock:
+      self._shas = set()
+
+if ndb:
+  class PushedBlob(ndb.Model):
+    # Key: PushedBlob(sha)
+    pass
+
+  # SHAs are only known once a frame is processed, so they can't be looked up
+  # by key up front. They are loaded once per run instead, keys only.
+  class NdbBlobStore(object):
+    def __init__(self):
+      self._shas = None
+
+    def load(self):
+      # Called before a run
+      self._shas = set(key.id() for key in PushedBlob.query().iter(keys_only = True, batch_size = 1000))
+
+    def contains(self, sha):
+      return sha in self._shas
+
+    def add_multi(self, shas):
+      ndb.put_multi([PushedBlob(id = sha) for sha in shas])
+      if self._shas != None:
+        self._shas.update(shas)
+
+    def clear(self):
+      keys = []
+      for key in PushedBlob.query().iter(keys_only = True):
+        keys.append(key)
+        if len(keys) >= 500:
+          ndb.delete_multi(keys)
+          keys = []
+      ndb.delete_multi(keys)
+      self._shas = set()
+
+_memory_store = None
+
+def default_store():
+  global _memory_store
+  if ndb:
+    return NdbBlobStore()
+  if _memory_store == None:
+    logging.warning("Datastore not available, keep pushed blobs in memory")
+    _memory_store = MemoryBlobStore()
+  return _memory_store
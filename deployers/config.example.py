@@ -6,3 +6,16 @@ ORG_NAME = 'organization name'
 REPO_NAME = 'repository name'
 TEAM_NAME = 'team to be added to repository'
 BRANCH = 'gh-pages'
+# Number of GET responses kept for conditional requests
+RESPONSE_CACHE_SIZE = 256
+# Crawl engine: 'thread', or 'event' (needs sockets, see crawler/event.py)
+CRAWLER_ENGINE = 'thread'
+# Seconds of a frame cron spent crawling, stalest stations go first
+FRAME_CRAWL_BUDGET = 240
+# Processes running frame processing, 0 to process in threads (App Engine).
+# Only worth it with several cores: on a single core the pool runs at 0.61x
+# (chunk size 1) to 0.85x (chunk size 8) of processing in threads
+# (benchmarks/process_pool.py)
+PROCESS_WORKERS = 0
+# Frames sent to a worker at once
+PROCESS_CHUNK_SIZE = 4
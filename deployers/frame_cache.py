@@ -0,0 +1,158 @@
+try:
+  from google.appengine.ext import ndb
+except ImportError:
+  ndb = None
+import os
+import json
+import time
+import logging
+import tempfile
+import threading
+from collections import namedtuple, OrderedDict
+from datetime import datetime, timedelta
+
+# Frames already turned into blobs, by source url, so that a run retrying a
+# failed deploy neither downloads nor processes them again.
+#
+# digest: git blob SHA of the processed PNG, blob: SHA GitHub gave the blob.
+# Entries are new after flush(), and expire after FRAME_CACHE_TTL.
+#
+# Unlike blob_store, blobs are cached before a commit references them, which is
+# the point, so GitHub may have garbage collected one by the time it is used.
+# Entries of a station whose tree can't be created are dropped, the next run
+# builds its frames again.
+ProcessedFrame = namedtuple('ProcessedFrame', ['digest', 'blob'])
+
+# Frames are only listed on the station pages for a few hours
+FRAME_CACHE_TTL = timedelta(hours = 6)
+# Entries kept by the local file cache, least recently used go first
+FILE_CACHE_SIZE = 5000
+
+class FileFrameCache(object):
+  def __init__(self, path = None, max_size = FILE_CACHE_SIZE, ttl = FRAME_CACHE_TTL):
+    if path == None:
+      path = os.path.join(tempfile.gettempdir(), 'radar-bot-frame-cache.json')
+    self.path = path
+    self.max_size = max_size
+    self.ttl = ttl.total_seconds()
+    self._lock = threading.Lock()
+    # url -> [digest, blob, time], least recently used first
+    self._frames = None
+    self._pending = {}
+
+  def _read(self):
+    try:
+      with open(self.path) as f:
+        return OrderedDict(json.load(f))
+    except (IOError, ValueError):
+      return OrderedDict()
+
+  def load(self, urls):
+    # Called before a run with the urls of its frames
+    with self._lock:
+      if self._frames == None:
+        self._frames = self._read()
+
+  def get(self, url):
+    with self._lock:
+      entry = self._frames.pop(url, None)
+      if entry == None or time.time() - entry[2] >= self.ttl:
+        return None
+      self._frames[url] = entry
+      return ProcessedFrame(entry[0], entry[1])
+
+  def put(self, url, digest, blob):
+    with self._lock:
+      self._pending[url] = [digest, blob, time.time()]
+
+  def drop(self, urls):
+    with self._lock:
+      if self._frames == None:
+        self._frames = self._read()
+      for url in urls:
+        self._frames.pop(url, None)
+        self._pending.pop(url, None)
+
+  def flush(self):
+    with self._lock:
+      if self._frames == None:
+        self._frames = self._read()
+      for url, entry in self._pending.iteritems():
+        self._frames.pop(url, None)
+        self._frames[url] = entry
+      count = len(self._pending)
+      self._pending = {}
+      while len(self._frames) > self.max_size:
+        self._frames.popitem(last = False)
+      with open(self.path, 'w') as f:
+        json.dump(self._frames.items(), f)
+      return count
+
+  def clear(self):
+    with self._lock:
+      self._frames = OrderedDict()
+      self._pending = {}
+      if os.path.exists(self.path):
+        os.remove(self.path)
+
+if ndb:
+  class CachedFrame(ndb.Model):
+    # Key: CachedFrame(frame url)
+    digest = ndb.StringProperty(indexed = False)
+    blob = ndb.StringProperty(indexed = False)
+    created = ndb.DateTimeProperty()
+
+  # ndb keeps entities in memcache, so loading is usually a memcache hit
+  class NdbFrameCache(object):
+    def __init__(self, ttl = FRAME_CACHE_TTL):
+      self.ttl = ttl
+      self._lock = threading.Lock()
+      self._frames = {}
+      self._pending = []
+
+    def load(self, urls):
+      keys = [ndb.Key(CachedFrame, url) for url in urls]
+      for key, entity in zip(keys, ndb.get_multi(keys)):
+        if entity and datetime.now() - entity.created < self.ttl:
+          self._frames[key.id()] = ProcessedFrame(entity.digest, entity.blob)
+
+    def get(self, url):
+      return self._frames.get(url)
+
+    def put(self, url, digest, blob):
+      with self._lock:
+        self._pending.append(CachedFrame(id = url, digest = digest, blob = blob, created = datetime.now()))
+
+    def drop(self, urls):
+      urls = set(urls)
+      with self._lock:
+        self._pending = [entity for entity in self._pending if entity.key.id() not in urls]
+        for url in urls:
+          self._frames.pop(url, None)
+      ndb.delete_multi([ndb.Key(CachedFrame, url) for url in urls])
+
+    def flush(self):
+      with self._lock:
+        pending = self._pending
+        self._pending = []
+      ndb.put_multi(pending)
+      # Expired entries
+      query = CachedFrame.query(CachedFrame.created < datetime.now() - self.ttl)
+      ndb.delete_multi(query.fetch(500, keys_only = True))
+      return len(pending)
+
+    def clear(self):
+      keys = []
+      for key in CachedFrame.query().iter(keys_only = True):
+        keys.append(key)
+        if len(keys) >= 500:
+          ndb.delete_multi(keys)
+          keys = []
+      ndb.delete_multi(keys)
+      self._frames = {}
+
+def default_cache():
+  if ndb:
+    return NdbFrameCache()
+  logging.warning("Datastore not available, keep processed frames in a local file")
+  return FileFrameCache()
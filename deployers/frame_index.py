@@ -0,0 +1,159 @@
+try:
+  from google.appengine.ext import ndb
+except ImportError:
+  ndb = None
+import re
+import bisect
+import logging
+from datetime import datetime, timedelta
+
+# Frames deployed for every station, ordered by time, so that frames.json can be
+# written without listing the station tree on GitHub. It is also where
+# Station.last_update comes from.
+#
+# Entries are (time, file name). Every update costs O(k) for k appended or
+# trimmed frames.
+
+# Frames older than this (relative to the newest one) are left out of frames.json
+# and dropped from the index. Their files stay until the daily clean.
+FRAME_RETENTION = timedelta(days = 1)
+
+# 1: YYYYMMDDHHmm
+FILE_NAME_TIME_RE = re.compile(".*_(\d{12})\d*\.\w+$")
+FILE_NAME_TIME_FORMAT = "%Y%m%d%H%M"
+
+def time_from_name(name):
+  m = FILE_NAME_TIME_RE.match(name)
+  if not m:
+    return None
+  return datetime.strptime(m.group(1), FILE_NAME_TIME_FORMAT)
+
+def publish_cadence(entries):
+  # Average seconds between frames, entries newest first
+  if len(entries) < 2:
+    return None
+  span = entries[0][0] - entries[-1][0]
+  return span.total_seconds() / (len(entries) - 1)
+
+def merge_newest_first(a, b):
+  # a, b: newest first lists of entries, names in a win
+  merged = []
+  seen = set()
+  i = 0
+  j = 0
+  while i < len(a) or j < len(b):
+    if j >= len(b) or (i < len(a) and a[i] >= b[j]):
+      entry = a[i]
+      i += 1
+    else:
+      entry = b[j]
+      j += 1
+    if entry[1] in seen:
+      continue
+    seen.add(entry[1])
+    merged.append(entry)
+  return merged
+
+class MemoryFrameIndex(object):
+  def __init__(self):
+    # Oldest first, so appending new frames is at the end
+    self._frames = {}
+
+  def append(self, station_id, entries):
+    frames = self._frames.setdefault(station_id, [])
+    for entry in sorted(entries):
+      if not frames or frames[-1] < entry:
+        frames.append(entry)
+        continue
+      i = bisect.bisect_left(frames, entry)
+      if i == len(frames) or frames[i] != entry:
+        frames.insert(i, entry)
+
+  def newest(self, station_id, limit = None, since = None):
+    # since: only frames at or after this time
+    frames = self._frames.get(station_id, [])
+    start = 0
+    if since != None:
+      start = bisect.bisect_left(frames, (since, ''))
+    if limit != None:
+      start = max(len(frames) - limit, start)
+    return frames[start:][::-1]
+
+  def newest_multi(self, station_ids, limit = None):
+    return dict((station_id, self.newest(station_id, limit)) for station_id in station_ids)
+
+  def last_update(self, station_id):
+    frames = self._frames.get(station_id)
+    if not frames:
+      return None
+    return frames[-1][0]
+
+  def trim(self, station_id, before):
+    frames = self._frames.get(station_id, [])
+    count = bisect.bisect_left(frames, (before, ''))
+    del frames[:count]
+    return count
+
+  def clear(self):
+    self._frames = {}
+
+if ndb:
+  class IndexedFrame(ndb.Model):
+    # Key: FrameIndex(station id) / IndexedFrame(file name)
+    time = ndb.DateTimeProperty()
+
+  def _index_key(station_id):
+    return ndb.Key('FrameIndex', station_id)
+
+  class NdbFrameIndex(object):
+    def append(self, station_id, entries):
+      parent = _index_key(station_id)
+      ndb.put_multi([IndexedFrame(parent = parent, id = name, time = time) for time, name in entries])
+
+    def _newest_query(self, station_id, since = None):
+      query = IndexedFrame.query(ancestor = _index_key(station_id))
+      if since != None:
+        query = query.filter(IndexedFrame.time >= since)
+      return query.order(-IndexedFrame.time)
+
+    def newest(self, station_id, limit = None, since = None):
+      # Time and key are all there is, no need to load the entities
+      query = self._newest_query(station_id, since)
+      return [(frame.time, frame.key.id()) for frame in query.fetch(limit, projection = [IndexedFrame.time])]
+
+    def newest_multi(self, station_ids, limit = None):
+      # Queries run in parallel instead of one round trip after another
+      futures = [(station_id, self._newest_query(station_id).fetch_async(limit, projection = [IndexedFrame.time])) for station_id in station_ids]
+      return dict((station_id, [(frame.time, frame.key.id()) for frame in future.get_result()]) for station_id, future in futures)
+
+    def last_update(self, station_id):
+      frames = self.newest(station_id, 1)
+      if not frames:
+        return None
+      return frames[0][0]
+
+    def trim(self, station_id, before):
+      query = IndexedFrame.query(IndexedFrame.time < before, ancestor = _index_key(station_id))
+      keys = query.fetch(keys_only = True)
+      ndb.delete_multi(keys)
+      return len(keys)
+
+    def clear(self):
+      keys = []
+      for key in IndexedFrame.query().iter(keys_only = True):
+        keys.append(key)
+        if len(keys) >= 500:
+          ndb.delete_multi(keys)
+          keys = []
+      ndb.delete_multi(keys)
+
+_memory_index = None
+
+def default_index():
+  global _memory_index
+  if ndb:
+    return NdbFrameIndex()
+  if _memory_index == None:
+    logging.warning("Datastore not available, keep frame index in memory")
+    _memory_index = MemoryFrameIndex()
+  return _memory_index
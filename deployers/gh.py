@@ -1,7 +1,11 @@
 import sys
 sys.path.insert(0, 'lib')
 from lib.github import *
-import urllib2
+import github.Organization
+import github.Repository
+import github.Team
+import github.GitRef
+import github.GitTree
 import config
 import base64
 import logging
@@ -10,9 +14,20 @@ from datetime import datetime
 import Queue
 import threading
 import json
-from cStringIO import StringIO
-import Image
-import process
+from process_pool import FramePool
+from session import Session, default_store as default_session_store
+from accounts import AccountScheduler, estimate_frame_requests
+from frame_index import default_index as default_frame_index, merge_newest_first, time_from_name, FRAME_RETENTION
+from blob_store import default_store as default_blob_store, git_blob_sha
+from frame_cache import default_cache as default_frame_cache
+from crawler.retry import RetryPolicy
+from crawler.client import FetchClient, FetchError
+
+# Conditional GETs for the objects auth() resolves on every run, shared by all accounts
+Github.set_response_cache(ResponseCache(getattr(config, 'RESPONSE_CACHE_SIZE', 256)))
+
+# Put once per thread to make it exit
+STOP = object()
 
 class BuilderThread(threading.Thread):
   def __init__(self, builder, id, max_retry = 3):
@@ -30,151 +45,341 @@ class BuilderThread(threading.Thread):
     builder = self.builder
     queue = builder.queue
     logging.debug("Thread %d started" % (self.id))
-    while not builder.should_exit:
-      if not queue.empty():
-        task = queue.get()
-        self.current_retry = 0
-        succ = False
-        while self.current_retry <= self.max_retry:
-          if self.current_retry > 0:
-            logging.warning("Failed last time, retrying (%d/%d)" % (self.current_retry, self.max_retry))
-          # Build
-          succ = self.build(task)
-          if succ:
-            break
-          self.current_retry += 1
-        if not succ:
-          logging.error("Fail to run %s" % (task[0]))
-          queue.task_done()
-          builder.fail_count += 1
-      time.sleep(1)
+    while True:
+      # Blocks until there is work, or the builder tells us to stop
+      task = queue.get()
+      if task is STOP:
+        queue.task_done()
+        break
+      start = time.time()
+      name = getattr(task[0], "url", task[0])
+      # Build, retried with backoff
+      succ = builder.retry_policy.run(builder.host, lambda: self.build(task), self.max_retry, name)
+      builder.add_busy_time(time.time() - start)
+      if not succ:
+        logging.error("Fail to run %s" % (name))
+        builder.fail_count += 1
+        builder.on_fail(task)
+        queue.task_done()
+
   def build(self, task):
     self.builder.append(task)
     return True
 
 class Builder(object):
-  def __init__(self, max_thread = 10, thread_klass = BuilderThread, max_retry = 3):
+  def __init__(self, max_thread = 10, thread_klass = BuilderThread, max_retry = 3, max_queue = 0, retry_policy = None, host = None):
     self.max_thread = max_thread
     self._threads = []
-    self.queue = Queue.Queue()
+    # Bounded when max_queue > 0, put() blocks until there is room
+    self.queue = Queue.Queue(max_queue)
     self.should_exit = False
     self._thread_klass = thread_klass
     self.fail_count = 0
+    # Kept by the last builder only, the others pass them on
     self.results = []
     self.max_retry = max_retry
+    # Results are passed on to the next builder, if any
+    self.next = None
+    self.name = thread_klass.__name__
+    # Where the tasks go, for the breaker and token bucket of retry_policy
+    self.host = host or self.name
+    self.retry_policy = retry_policy or RetryPolicy(name = self.name)
+    # Metrics
+    self._metrics_lock = threading.Lock()
+    self._start_time = None
+    self.done_count = 0
+    self.busy_time = 0.0
+    self.put_count = 0
+    self.max_depth = 0
+    self._depth_total = 0
+
+  def put(self, task):
+    self.queue.put(task)
+    depth = self.queue.qsize()
+    with self._metrics_lock:
+      self.put_count += 1
+      self._depth_total += depth
+      if depth > self.max_depth:
+        self.max_depth = depth
+
+  def add_busy_time(self, seconds):
+    with self._metrics_lock:
+      self.busy_time += seconds
 
   def append(self, result):
-    self.results.append(result)
+    with self._metrics_lock:
+      self.done_count += 1
+    if self.next == None:
+      self.results.append(result)
     if self.on_append(result):
       self.queue.task_done()
 
   def on_append(self, result):
+    if self.next:
+      self.next.put(result)
     return True
 
+  def on_fail(self, task):
+    pass
+
   def _init_threads(self):
     for id in range(self.max_thread):
       t = self._thread_klass(self, id, max_retry = self.max_retry)
       self._threads.append(t)
       t.start()
 
-  def build(self, tasks):
+  def start(self):
+    self._start_time = time.time()
     # Create threads to size
     self._init_threads()
-    logging.info("Put %d tasks" % (len(tasks)))
-    # Put tasks
-    for task in tasks:
-      self.queue.put(task)
+
+  def finish(self):
     logging.info("Waiting for tasks")
     # Wait
     self.queue.join()
     logging.info("Tasks completed")
     # Notify threads to exit
     self.should_exit = True
+    for t in self._threads:
+      self.queue.put(STOP)
     # Wait
     for t in self._threads:
       t.join()
     logging.info("Threads completed")
+    self.log_metrics()
+
+  def log_metrics(self):
+    elapsed = max(time.time() - self._start_time, 0.001)
+    done = self.done_count
+    avg_depth = float(self._depth_total) / self.put_count if self.put_count else 0
+    logging.info("Stage %s: %d done, %d failed in %.1fs (%.2f/s), busy %.1fs, queue depth max %d avg %.1f" % (
+      self.name, done, self.fail_count, elapsed, done / elapsed, self.busy_time, self.max_depth, avg_depth))
+
+  def build(self, tasks):
+    self.start()
+    logging.info("Put %d tasks" % (len(tasks)))
+    # Put tasks
+    for task in tasks:
+      self.put(task)
+    self.finish()
+
+GITHUB_HOST = 'api.github.com'
 
 class RepoBuilder(Builder):
-  def __init__(self, repo, max_thread = 10, thread_klass = BuilderThread, max_retry = 3):
-    Builder.__init__(self, max_thread, thread_klass, max_retry = max_retry)
+  def __init__(self, repo, max_thread = 10, thread_klass = BuilderThread, max_retry = 3, scheduler = None, max_queue = 0, retry_policy = None, host = GITHUB_HOST):
+    Builder.__init__(self, max_thread, thread_klass, max_retry = max_retry, max_queue = max_queue, retry_policy = retry_policy, host = host)
     self.repo = repo
+    self.scheduler = scheduler
 
 BASE_URL = "http://image.weather.gov.cn"
+IMAGE_HOST = 'image.weather.gov.cn'
+
+# ## Frame Pipeline
+#
+# Frames go through download -> process -> blob stages, each with its own threads
+# and a bounded queue in front, so a slow download only holds up its own frame.
+# Stage tasks are (frame, data). Once every frame of a station has its blob (or
+# failed), the station goes to the tree stage right away.
+PIPELINE_QUEUE_SIZE = 20
+
+class DownloadThread(BuilderThread):
+  def download(self, url):
+    # Over the stage's kept alive connections to the image host
+    status, headers, data, url = self.builder.client.get(url)
+    if status != 200:
+      raise FetchError("HTTP %d from %s" % (status, url))
+    return data
 
-class BlobBuilderThread(BuilderThread):
-  def download_to_base64(self, url):
-    content = None
+  def build(self, task):
+    frame = task[0]
+    start = time.time()
+    try:
+      data = self.download(BASE_URL + frame.url)
+    except Exception as e:
+      logging.error("Fail to download %s: %s" % (frame.url, e))
+      return False
+    logging.info("Downloaded %s: %d bytes in %.0fms" % (frame.url, len(data), (time.time() - start) * 1000))
+    self.builder.append((frame, data))
+    return True
+
+class ProcessThread(BuilderThread):
+  def build(self, task):
+    frame = task[0]
     try:
-      remote_file = urllib2.urlopen(url ,timeout = 30)
-      image = Image.open(StringIO(remote_file.read()))
-      content = process.run_crop_only(image)
+      # In a worker process, or in this thread
+      content = self.builder.pool.run(task[1])
     except Exception as e:
-      logging.error("Fail to download %s: %s" % (url, e))
-    return content
+      logging.error("Fail to process %s: %s" % (frame.url, e))
+      return False
+    self.builder.append((frame, content))
+    return True
 
+class BlobBuilderThread(BuilderThread):
   def create_blob(self, content):
     sha = None
+    scheduler = self.builder.scheduler
+    account = scheduler.acquire() if scheduler else None
+    repo = account.repo if account else self.builder.repo
     try:
-      blob = self.builder.repo.create_git_blob(content, 'base64')
+      blob = repo.create_git_blob_from_data(content)
       sha = blob.sha
     except Exception as e:
       logging.error("Fail to create blob: %s" % (e))
+    finally:
+      if account:
+        scheduler.release(account)
     return sha
 
   def build(self, task):
-    logging.info("Building blob from %s" % (task.url))
-    content = self.download_to_base64(BASE_URL + task.url)
-    if not content:
-      return False
-    sha = self.create_blob(content)
+    frame = task[0]
+    blob_store = self.builder.blob_store
+    # Same content, same SHA: a blob pushed before is used as is
+    known = git_blob_sha(task[1])
+    if blob_store.contains(known):
+      logging.info("Blob of %s already pushed: %s" % (frame.url, known))
+      self.builder.add_reused()
+      self.builder.frame_cache.put(frame.url, known, known)
+      frame.blob = known
+      self.builder.append((frame, known))
+      return True
+    logging.info("Building blob from %s" % (frame.url))
+    sha = self.create_blob(task[1])
     if not sha:
       return False
-    task.blob = sha
+    # Goes into blob_store once a commit references it, see deploy_frames_with
+    self.builder.frame_cache.put(frame.url, known, sha)
+    frame.blob = sha
     logging.info("Blob: %s" % (sha))
-    self.builder.append(task)
+    self.builder.append((frame, sha))
     return True
 
+class StationTracker(object):
+  # Hands a station to the tree stage once all of its frames are resolved
+  def __init__(self, payload, old_trees, tree_builder):
+    self.pending = dict((id, len(frames)) for id, frames in payload.iteritems())
+    self.ready = dict((id, []) for id in payload)
+    self.old_trees = old_trees
+    self.tree_builder = tree_builder
+    self._lock = threading.Lock()
+
+  def frame_done(self, frame, succ):
+    id = frame.station_id
+    with self._lock:
+      if succ:
+        self.ready[id].append(frame)
+      self.pending[id] -= 1
+      if self.pending[id] > 0:
+        return
+      frames = self.ready[id]
+    if not frames:
+      logging.error("No frame of station %s made it, skip its tree" % (id))
+      return
+    self.tree_builder.put((id, frames, self.old_trees.get(id)))
+
+class TreeStage(RepoBuilder):
+  frame_cache = None
+
+  def on_fail(self, task):
+    # Cached blobs may be what the tree was refused for
+    self.frame_cache.drop([frame.url for frame in task[1]])
+
+class FrameStage(RepoBuilder):
+  tracker = None
+
+  def on_fail(self, task):
+    self.tracker.frame_done(task[0], False)
+
+class DownloadStage(FrameStage):
+  def __init__(self, repo, max_thread = 10, timeout = 30, **kwargs):
+    FrameStage.__init__(self, repo, max_thread, DownloadThread, host = IMAGE_HOST, **kwargs)
+    # One connection per thread at most
+    self.client = FetchClient(max_thread, timeout)
+
+  def log_metrics(self):
+    FrameStage.log_metrics(self)
+    self.client.close()
+    self.client.log_stats()
+
+class BlobStage(FrameStage):
+  blob_store = None
+  frame_cache = None
+  reused_count = 0
+
+  def add_reused(self):
+    with self._metrics_lock:
+      self.reused_count += 1
+
+  def on_append(self, result):
+    self.tracker.frame_done(result[0], True)
+    return True
+
+  def log_metrics(self):
+    FrameStage.log_metrics(self)
+    logging.info("%d blobs pushed before, not uploaded again" % (self.reused_count))
+
+def lazy_tree(repo, sha):
+  # Enough to be used as base_tree, without fetching it
+  return github.GitTree.GitTree(repo._requester, {}, {"sha": sha, "url": repo.url + "/git/trees/" + sha}, completed = False)
+
 class TreeBuilderThread(BuilderThread):
-  def build_frame_json(self, frame_names):
+  def build_frame_json(self, entries):
     # Newest first
-    frame_names.sort(reverse = True)
-    return json.dumps(frame_names)
+    return json.dumps([entry[1] for entry in entries])
+
+  def list_frames(self, tree_sha):
+    # Only for stations the index doesn't know yet
+    logging.info("Listing tree %s for frame index" % (tree_sha))
+    old_tree = self.builder.repo.get_git_tree(tree_sha)
+    entries = []
+    for e in old_tree.tree:
+      if e.type != 'blob' or e.path == 'frames.json':
+        continue
+      time = time_from_name(e.path)
+      if time:
+        entries.append((time, e.path))
+    entries.sort(reverse = True)
+    return entries
 
   def build(self, task):
     id = task[0]
     frames = task[1]
     old_tree_sha = task[2]
     logging.info("Build tree %s for %d frames based upon %s" % (id, len(frames), old_tree_sha))
-    # Get old tree
-    old_tree = None
-    if old_tree_sha:
-      # Get old tree
+    # Only new entries are posted, the rest comes from the old tree
+    elements = []
+    new_entries = []
+    for frame in frames:
+      name = frame.get_file_name().replace('.GIF', '.PNG')
+      elements.append(InputGitTreeElement(name, '100644', 'blob', sha = frame.blob))
+      new_entries.append((frame.time, name))
+    new_entries.sort(reverse = True)
+    # Build frames.json from the index
+    index = self.builder.frame_index
+    # Only what can still be in frames.json, the newest frame seen decides
+    old_entries = index.newest(id, since = new_entries[0][0] - FRAME_RETENTION)
+    if not old_entries and old_tree_sha and index.last_update(id) == None:
       try:
-        old_tree = self.builder.repo.get_git_tree(old_tree_sha)
+        old_entries = self.list_frames(old_tree_sha)
       except Exception as e:
         logging.error("Fail to get tree %s: %s" % (old_tree_sha, e))
         return False
-    # Create tree element list
-    elements = [InputGitTreeElement(frame.get_file_name().replace('.GIF', '.PNG'), '100644', 'blob', sha = frame.blob) for frame in frames]
-    if old_tree:
-      elements += [InputGitTreeElement(e.path, e.mode, e.type, sha = e.sha) for e in old_tree.tree]
-    # Build frames.json
-    frame_names = []
-    for el in elements:
-      identity = el._identity
-      if identity['type'] != 'blob' or identity['path'] == 'frames.json':
-        continue
-      frame_names.append(identity['path'])
-    json_content = self.build_frame_json(frame_names)
+      # Bootstrapped entries go into the index as well
+      new_entries = merge_newest_first(new_entries, old_entries)
+    entries = merge_newest_first(new_entries, old_entries)
+    cutoff = entries[0][0] - FRAME_RETENTION
+    entries = [entry for entry in entries if entry[0] >= cutoff]
+    json_content = self.build_frame_json(entries)
     # Create frames.json blob
     json_blob = self.builder.repo.create_git_blob(json_content, 'utf-8')
     elements.append(InputGitTreeElement('frames.json', '100644', 'blob', sha = json_blob.sha))
     # Create tree
-    tree = self.builder.repo.create_git_tree(elements)
+    if old_tree_sha:
+      tree = self.builder.repo.create_git_tree(elements, lazy_tree(self.builder.repo, old_tree_sha))
+    else:
+      tree = self.builder.repo.create_git_tree(elements)
     for frame in frames:
       frame.tree = tree.sha
-    self.builder.append((id, tree.sha))
+    self.builder.append((id, tree.sha, new_entries, cutoff, [frame.blob for frame in frames]))
     logging.info("Tree: %s" % (tree.sha))
     return True
 
@@ -188,14 +393,35 @@ def print_tree(repo, sha, path = '/'):
       sub_trees.append((e.sha, e.path))
   [print_tree(repo, s[0], path + s[1] + '/') for s in sub_trees]
 
+# Below this many remaining API calls an account is not used
+RATE_LIMIT_THRESHOLD = 100
+
+# Lives as long as the instance, so rates seen by earlier runs are reused
+_scheduler = None
+
+def get_scheduler():
+  global _scheduler
+  if _scheduler == None:
+    _scheduler = AccountScheduler(config.ACCOUNTS, RATE_LIMIT_THRESHOLD)
+  return _scheduler
+
 class GitHubDeployer(object):
-  def __init__(self, payload, type = 'frame'):
+  def __init__(self, payload, type = 'frame', session_store = None, frame_index = None, blob_store = None, frame_cache = None):
     self.payload = payload
     self.type = type
+    self.session_store = session_store or default_session_store()
+    self.frame_index = frame_index or default_frame_index()
+    self.blob_store = blob_store or default_blob_store()
+    self.frame_cache = frame_cache or default_frame_cache()
+    # Stations whose tree made it into the commit
+    self.deployed_stations = set()
+    # Backoff and breakers for every retried call of this deploy
+    self.github_policy = RetryPolicy(name = 'GitHub retries')
+    self.image_policy = RetryPolicy(name = 'Image retries')
 
   def clean(self):
     try:
-      self.auth()
+      self.auth(resume = False)
     except Exception as e:
       logging.warning("Auth with error: %s" % (e))
     if not self.user:
@@ -210,6 +436,10 @@ class GitHubDeployer(object):
       self.repo = self.org.create_repo(config.REPO_NAME, auto_init = True, team_id = self.team)
     else:
       self.repo = self.org.create_repo(config.REPO_NAME, auto_init = True)
+    # No frames or blobs in the new repository
+    self.frame_index.clear()
+    self.blob_store.clear()
+    self.frame_cache.clear()
     if config.BRANCH == 'master':
       return True
     master = self.repo.get_branch('master')
@@ -222,15 +452,84 @@ class GitHubDeployer(object):
     logging.info("Ref created: %s" % (ref.url))
     return True
 
-  def auth(self):
+  def auth(self, resume = True):
+    if resume:
+      try:
+        if self.resume():
+          return True
+      except Exception as e:
+        # Don't let a broken session or a transient error stop every deploy
+        logging.error("Resume Error: %s, discover again" % (e))
+        try:
+          self.session_store.clear()
+        except Exception as e:
+          logging.warning("Fail to clear GitHub session: %s" % (e))
     for account in config.ACCOUNTS:
       try:
         if self.auth_one(account[0], account[1]):
+          self.save_session()
           return True
       except Exception as e:
         logging.error("Auth Error: %s" % (e))
     logging.error("All GitHub accounts failed to be authenticated")
 
+  def save_session(self):
+    session = Session(self.username, self.org.login, self.team.id if self.team else None, self.repo.name, config.BRANCH)
+    try:
+      self.session_store.save(session)
+    except Exception as e:
+      logging.warning("Fail to save GitHub session: %s" % (e))
+
+  def on_api_error(self, e):
+    # Credentials revoked or repository gone, discover everything again next time
+    if getattr(e, 'status', None) in (401, 404):
+      logging.warning("Drop GitHub session after error %s" % (e.status))
+      self.session_store.clear()
+
+  def resume(self):
+    session = self.session_store.load()
+    if not session or not session.matches(config):
+      return False
+    password = dict(config.ACCOUNTS).get(session.username)
+    if password == None:
+      return False
+    logging.info("Resume session of %s" % (session.username))
+    g = Github(session.username, password)
+    user = g.get_user()
+    requester = user._requester
+    # Resolved names are enough to address everything, no need to fetch them
+    org = github.Organization.Organization(requester, {}, {"url": "/orgs/" + session.org, "login": session.org}, completed = False)
+    team = None
+    if session.team_id != None:
+      team = github.Team.Team(requester, {}, {"url": "/teams/%d" % (session.team_id), "id": session.team_id}, completed = False)
+    repo_url = "/repos/%s/%s" % (session.org, session.repo)
+    repo = github.Repository.Repository(requester, {}, {"url": repo_url, "name": session.repo}, completed = False)
+    # The one call: checks credentials and repository, and reads branch head
+    try:
+      branch = repo.get_branch(session.branch)
+    except Exception as e:
+      if getattr(e, 'status', None) in (401, 404):
+        logging.warning("GitHub session is no longer valid: %s" % (e))
+        self.session_store.clear()
+        return False
+      raise
+    rate = g.rate_limiting
+    logging.info("Resumed %s, rate: (%d/%d)" % (session.username, rate[0], rate[1]))
+    if rate[0] < RATE_LIMIT_THRESHOLD:
+      logging.warning("Not enough GitHub API Rate, discover again")
+      self.session_store.clear()
+      return False
+    logging.info("Find branch %s @%s" % (branch.name, branch.commit.sha))
+    self.g = g
+    self.user = user
+    self.username = session.username
+    self.org = org
+    self.team = team
+    self.repo = repo
+    self.branch = branch
+    self.ref = github.GitRef.GitRef(requester, {}, {"url": repo_url + "/git/refs/heads/" + session.branch, "ref": "refs/heads/" + session.branch}, completed = False)
+    return True
+
   def auth_one(self, username, password):
     logging.info("Log in %s" % (username))
     g = Github(username, password)
@@ -240,8 +539,9 @@ class GitHubDeployer(object):
     rate = g.rate_limiting
     logging.info("Logged in as %s, rate: (%d/%d)" % (user.login, rate[0], rate[1]))
     self.user = user
+    self.username = username
 
-    if rate[0] < 100:
+    if rate[0] < RATE_LIMIT_THRESHOLD:
       logging.warning("Not enough GitHub API Rate, try another")
       return False
 
@@ -337,6 +637,8 @@ class GitHubDeployer(object):
     succ = False
     while current_retry <= max_retry:
       if current_retry > 0:
+        if not self.github_policy.backoff(GITHUB_HOST, current_retry, max_retry):
+          break
         logging.warning("Retry (%d/%d)" % (current_retry, max_retry))
       current_retry += 1
       try:
@@ -347,14 +649,10 @@ class GitHubDeployer(object):
         # Update tree
         last_commit_sha = self.branch.commit.sha
         if not root:
-          root = self.repo.get_git_tree(last_commit_sha)
+          root = lazy_tree(self.repo, self.branch.commit.commit.tree.sha)
         if not new_root:
-          elements = []
-          for e in root.tree:
-            if e.path != 'stations.json':
-              elements.append(InputGitTreeElement(e.path, e.mode, e.type, sha = e.sha))
-          elements.append(InputGitTreeElement('stations.json', '100644', 'blob', sha = blob.sha))
-          new_root = self.repo.create_git_tree(elements)
+          elements = [InputGitTreeElement('stations.json', '100644', 'blob', sha = blob.sha)]
+          new_root = self.repo.create_git_tree(elements, root)
         logging.info("Tree: %s" % (new_root.sha))
         # Create commit
         if not parent_commit:
@@ -365,41 +663,27 @@ class GitHubDeployer(object):
         # Update ref
         self.ref.edit(commit.sha)
         logging.info("Ref updated")
+        self.github_policy.record(GITHUB_HOST, True)
         succ = True
         break
       except Exception as e:
         logging.error("Deploy error: %s" % (e))
+        self.github_policy.record(GITHUB_HOST, False)
+        self.on_api_error(e)
+    self.github_policy.log_stats()
     return succ
 
   def make_commit(self, message, root, new_trees):
     logging.info("Create new root")
-    new_root_elements = []
-    last_commit_sha = self.branch.commit.sha
-    if self.repo.update():
-      # Fetch new root
-      logging.info("Last commit updated, fetching root")
-      root = self.repo.get_git_tree(last_commit_sha)
     last_commit_sha = self.branch.commit.sha
 
-    for e in root.tree:
-      if e.type == 'tree' and new_trees.has_key(e.path):
-        new_sha = new_trees[e.path]
-        logging.info("Replace tree %s with %s" % (e.path, new_sha))
-        # replace with new tree
-        new_e = InputGitTreeElement(e.path, '040000', 'tree', sha = new_sha)
-        new_root_elements.append(new_e)
-        del new_trees[e.path]
-      else:
-        new_root_elements.append(InputGitTreeElement(e.path, e.mode, e.type, sha = e.sha))
-
-    for path in new_trees:
-      new_sha = new_trees[path]
-      logging.info("Add new tree %s to %s" % (new_sha, path))
-      new_e = InputGitTreeElement(path, '040000', 'tree', sha = new_sha)
-      new_root_elements.append(new_e)
-
-
-    new_root = self.repo.create_git_tree(new_root_elements)
+    # Only station trees change, everything else comes from the old root
+    new_root_elements = []
+    for path, new_sha in new_trees.iteritems():
+      logging.info("Set tree %s to %s" % (path, new_sha))
+      new_root_elements.append(InputGitTreeElement(path, '040000', 'tree', sha = new_sha))
+
+    new_root = self.repo.create_git_tree(new_root_elements, root)
     logging.info("New root tree: %s" % (new_root.sha))
     # Make commit
     parent_commit = self.repo.get_git_commit(last_commit_sha)
@@ -411,39 +695,101 @@ class GitHubDeployer(object):
     return new_commit
 
   def deploy_frames(self):
-    max_retry = 5
-    current_retry = 0
-    stage_succ = False
-
     if not self.auth():
       return False
     # Check
     if len(self.payload) == 0:
       logging.info("Nothing to deploy")
       return True
-    # Prepare blobs for every frame
     all_frames = reduce(lambda f1, f2: f1 + f2, self.payload.values())
-    blob_builder = RepoBuilder(self.repo, thread_klass = BlobBuilderThread, max_retry = 10)
-    blob_builder.build(all_frames)
+    # Trees and commit go through the authenticated account,
+    # blobs are spread over every account with rate to spare
+    scheduler = get_scheduler()
+    reservations = []
+    try:
+      scheduler.prepare("/repos/%s/%s" % (self.org.login, self.repo.name))
+      reservation = scheduler.reserve(self.username, estimate_frame_requests(len(self.payload)))
+      if reservation:
+        reservations.append(reservation)
+      if not scheduler.fits(len(all_frames)):
+        logging.error("Not enough GitHub API Rate for %d frames, budget: %d" % (len(all_frames), scheduler.budget()))
+        return False
+      logging.info("GitHub API budget: %d for %d frames" % (scheduler.budget(), len(all_frames)))
+      return self.deploy_frames_with(scheduler, all_frames)
+    finally:
+      scheduler.finish(reservations)
 
+  def read_root(self):
+    max_retry = 5
+    current_retry = 0
     # Read old trees
     last_commit_sha = self.branch.commit.sha
     logging.info("Reading root tree @%s" % (last_commit_sha))
-
-    root = None
-    current_retry = 0
-    stage_succ = False
-
-    while current_retry <= max_retry and not stage_succ:
+    while current_retry <= max_retry:
       if current_retry > 0:
+        if not self.github_policy.backoff(GITHUB_HOST, current_retry, max_retry):
+          break
         logging.warning("Retry (%d/%d)" % (current_retry, max_retry))
       try:
         root = self.repo.get_git_tree(last_commit_sha)
-        stage_succ = True
+        self.github_policy.record(GITHUB_HOST, True)
+        return root
       except Exception as e:
         logging.error("Error: %s" % (e))
+        self.github_policy.record(GITHUB_HOST, False)
+        self.on_api_error(e)
       current_retry += 1
-    if not stage_succ:
+
+  def build_frames(self, scheduler, old_trees):
+    repo = self.repo
+    download = DownloadStage(repo, max_retry = 10, max_queue = PIPELINE_QUEUE_SIZE, retry_policy = self.image_policy)
+    # Before any thread is started, workers are forked
+    pool = FramePool(getattr(config, 'PROCESS_WORKERS', 0), getattr(config, 'PROCESS_CHUNK_SIZE', 4))
+    processor = FrameStage(repo, max_thread = pool.max_thread or 2, thread_klass = ProcessThread, max_retry = 0, max_queue = PIPELINE_QUEUE_SIZE, host = 'process')
+    processor.pool = pool
+    blob = BlobStage(repo, thread_klass = BlobBuilderThread, max_retry = 10, scheduler = scheduler, max_queue = PIPELINE_QUEUE_SIZE, retry_policy = self.github_policy)
+    tree = TreeStage(repo, thread_klass = TreeBuilderThread, max_queue = PIPELINE_QUEUE_SIZE, retry_policy = self.github_policy)
+    blob.blob_store = self.blob_store
+    blob.frame_cache = self.frame_cache
+    tree.frame_cache = self.frame_cache
+    tree.frame_index = self.frame_index
+    tracker = StationTracker(self.payload, old_trees, tree)
+    download.next = processor
+    processor.next = blob
+    stages = [download, processor, blob, tree]
+    for stage in stages[:-1]:
+      stage.tracker = tracker
+    try:
+      for stage in stages:
+        stage.start()
+      self.frame_cache.load([frame.url for frames in self.payload.itervalues() for frame in frames])
+      self.blob_store.load()
+      cached_count = 0
+      for frames in self.payload.itervalues():
+        for frame in frames:
+          cached = self.frame_cache.get(frame.url)
+          if cached:
+            # Made into a blob by an earlier run, whose deploy didn't make it
+            frame.blob = cached.blob
+            tracker.frame_done(frame, True)
+            cached_count += 1
+            continue
+          download.put((frame, None))
+      logging.info("%d frames already made into blobs" % (cached_count))
+      # Everything a stage produced is queued in the next one once it finishes
+      for stage in stages:
+        stage.finish()
+    finally:
+      # Workers are forked processes, never leave them behind
+      pool.close()
+    # Kept even if the commit fails, the blobs are there
+    self.frame_cache.flush()
+    return tree
+
+  def deploy_frames_with(self, scheduler, all_frames):
+    max_retry = 5
+    root = self.read_root()
+    if not root:
       return False
 
     old_trees = {}
@@ -452,28 +798,30 @@ class GitHubDeployer(object):
         continue
       if self.payload.has_key(e.path):
         old_trees[e.path] = e.sha
-    #print_tree(self.repo, self.branch.commit.sha)
-    # Prepare trees for every stations
-    logging.info("Creating sub trees")
-    all_trees = []
-    for id, frames in self.payload.iteritems():
-      all_trees.append((id, frames, old_trees.get(id)))
-    tree_builder = RepoBuilder(self.repo, thread_klass = TreeBuilderThread)
-    tree_builder.build(all_trees)
+    # Download, process and create blobs for every frame,
+    # and trees for every station as soon as its frames are ready
+    logging.info("Building %d frames for %d stations" % (len(all_frames), len(self.payload)))
+    tree_builder = self.build_frames(scheduler, old_trees)
 
     # Make new root tree
     # Note: should update and fetch new root to avoid race condition
     #       subfolers are OK since only one instance will update them at a time
     new_trees = {}
+    # Only frames that made it into a tree
+    frame_count = 0
     for t in tree_builder.results:
       new_trees[t[0]] = t[1]
+      frame_count += len(t[4])
     # Make commit
     new_commit = None
     current_retry = 0
     stage_succ = False
-    message = "Update %d frames for %d stations at %s" % (len(all_frames), len(self.payload), datetime.now())
+    logging.info("%d of %d frames made it into %d station trees" % (frame_count, len(all_frames), len(new_trees)))
+    message = "Update %d frames for %d stations at %s" % (frame_count, len(new_trees), datetime.now())
     while current_retry <= max_retry and not stage_succ:
       if current_retry > 0:
+        if not self.github_policy.backoff(GITHUB_HOST, current_retry, max_retry):
+          break
         logging.warning("Retry (%d/%d)" % (current_retry, max_retry))
       try:
         new_commit = self.make_commit(message, root, new_trees)
@@ -481,17 +829,47 @@ class GitHubDeployer(object):
         # Update ref
         logging.info("Update ref")
         self.ref.edit(new_commit.sha)
+        self.github_policy.record(GITHUB_HOST, True)
         stage_succ = True
       except Exception as e:
         logging.error("Error: %s" % (e))
+        self.github_policy.record(GITHUB_HOST, False)
+        self.on_api_error(e)
       current_retry += 1
     if not stage_succ:
       return False
+    self.deployed_stations = set(new_trees)
+
+    # Frames are on GitHub now, remember them for the next frames.json
+    try:
+      for id, tree_sha, entries, cutoff, blobs in tree_builder.results:
+        self.frame_index.append(id, entries)
+        self.frame_index.trim(id, cutoff)
+    except Exception as e:
+      logging.error("Fail to update frame index: %s" % (e))
+    # Reachable from a commit, GitHub keeps them. Blobs of a failed deploy are
+    # not recorded, they may be garbage collected
+    try:
+      self.blob_store.add_multi(set(sha for t in tree_builder.results for sha in t[4]))
+    except Exception as e:
+      logging.error("Fail to record pushed blobs: %s" % (e))
 
     # Done
     logging.info("Deploy finished")
+    self.log_api_stats()
     return True
 
+  def log_api_stats(self):
+    stats = self.g.connection_pool.stats
+    logging.info("GitHub connections: %(handshakes)d handshakes, %(reuses)d reuses, %(reconnects)d reconnects" % stats)
+    if self.g.response_cache:
+      stats = self.g.response_cache.stats
+      logging.info("GitHub response cache: %(hits)d hits, %(misses)d misses, %(evictions)d evictions, %(size)d entries" % stats)
+    rate = self.g.rate_limiting
+    logging.info("GitHub rate of %s: (%d/%d)" % (self.username, rate[0], rate[1]))
+    self.github_policy.log_stats()
+    self.image_policy.log_stats()
+
 def open_and_encode(path):
   with open(path, 'rb') as image_f:
     return base64.b64encode(image_f.read())
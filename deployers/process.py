@@ -102,7 +102,7 @@ def erode(image):
             for d in BOX_3:
                 bx = x + d[0]
                 by = y + d[1]
-                if bx < 0 or by < 0 or bx >= image.size[0] or by >= image.size[0]:
+                if bx < 0 or by < 0 or bx >= image.size[0] or by >= image.size[1]:
                     continue
                 if p[bx, by] == 0:
                     keep = False
@@ -126,7 +126,7 @@ def dilate(image):
             for d in BOX_3:
                 bx = x + d[0]
                 by = y + d[1]
-                if bx < 0 or by < 0 or bx >= image.size[0] or by >= image.size[0]:
+                if bx < 0 or by < 0 or bx >= image.size[0] or by >= image.size[1]:
                     continue
                 if p[bx, by] != 0:
                     keep = True
@@ -176,6 +176,111 @@ def get_inpaint_mask(radar_image, border_image):
     return mask(border_image, close_op(binary))
 
 
+# ## NumPy Backend
+#
+# Same steps as above, but the frame is turned into a `uint8` array once and every
+# step is a whole-array operation. Results are identical to the pure PIL version,
+# including the edge handling: out of bound neighbours are skipped, so erosion
+# pads with `1` and dilation pads with `0`.
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+def to_array(image):
+    return numpy.asarray(image, dtype = numpy.uint8)
+
+def from_array(data, palette):
+    dst = Image.fromarray(numpy.ascontiguousarray(data, dtype = numpy.uint8), 'P')
+    dst.putpalette(palette)
+    return dst
+
+def np_extract_borders(data, border_colors = BORDER_COLORS):
+    is_border = numpy.in1d(data, border_colors).reshape(data.shape)
+    # Same integer math as `int(c * 255 / 15)`, clipped like `putdata` does
+    radar = numpy.clip(data.astype(numpy.int32) * 255 // 15, 0, 255).astype(numpy.uint8)
+    radar[is_border] = 0
+    return is_border.astype(numpy.uint8), radar
+
+def np_binarize(data):
+    return (data != 0).astype(numpy.uint8)
+
+def _np_box_3(data, pad_value, reduce_op):
+    h, w = data.shape
+    padded = numpy.empty((h + 2, w + 2), dtype = numpy.uint8)
+    padded.fill(pad_value)
+    padded[1:-1, 1:-1] = data != 0
+    dst = padded[1:-1, 1:-1].copy()
+    for d in BOX_3:
+        reduce_op(dst, padded[1 + d[1]:h + 1 + d[1], 1 + d[0]:w + 1 + d[0]], dst)
+    return dst
+
+def np_erode(data):
+    return _np_box_3(data, 1, numpy.minimum)
+
+def np_dilate(data):
+    return _np_box_3(data, 0, numpy.maximum)
+
+def np_close_op(data):
+    return np_erode(np_dilate(data))
+
+def np_mask(data, mask):
+    return numpy.where(mask != 0, data, 0).astype(numpy.uint8)
+
+def np_get_inpaint_mask(radar, border):
+    return np_mask(border, np_close_op(np_binarize(radar)))
+
+
+# ## Backends
+#
+# A backend takes a cropped frame (or a region of it) and returns the radar image
+# and the inpaint mask, both as PIL images ready for `inpaint`.
+def prepare_pil(image):
+    border, radar = extract_borders(image)
+    return radar, get_inpaint_mask(radar, border)
+
+def prepare_numpy(image):
+    border, radar = np_extract_borders(to_array(image))
+    mask = np_get_inpaint_mask(radar, border)
+    return from_array(radar, RADAR_PALETTE), from_array(mask, BINARY_PALETTE)
+
+BACKENDS = {
+    'pil': prepare_pil
+}
+if numpy is not None:
+    BACKENDS['numpy'] = prepare_numpy
+
+DEFAULT_BACKEND = 'numpy' if numpy is not None else 'pil'
+
+
+# ## Region of Interest
+#
+# Radar echoes usually cover a small part of the disc. Outside the bounding box of
+# echo pixels the radar image is `0`, the inpaint mask is empty and the output is
+# `0` as well, so the whole pipeline only needs to run inside that box.
+#
+# The box is expanded by a halo so that the result is the same as processing the
+# whole frame: closing reaches 1px out of the echoes, so the mask does too,
+# and inpaint reads 2px around the mask.
+ROI_HALO = 3
+
+def get_radar_bbox(image, border_colors = BORDER_COLORS):
+    # Echo pixels are anything but transparent and borders
+    lut = [0 if c == 0 or c in border_colors else 1 for c in range(256)]
+    return image.point(lut).getbbox()
+
+def get_roi(image, halo = ROI_HALO):
+    bbox = get_radar_bbox(image)
+    if not bbox:
+        return
+    return (
+        max(bbox[0] - halo, 0),
+        max(bbox[1] - halo, 0),
+        min(bbox[2] + halo, image.size[0]),
+        min(bbox[3] + halo, image.size[1])
+    )
+
+
 # ## Inpaint Algorithm
 #
 # In this section, a simplified version of OpenCV inpainting alorithm will be implemented. It is based on [An Image Inpainting Technique Based on the Fast Marching Method](http://iwi.eldoc.ub.rug.nl/FILES/root/2004/JGraphToolsTelea/2004JGraphToolsTelea.pdf).
@@ -357,8 +462,217 @@ def inpaint(image, mask):
     dst.putdata(data)
     return dst
 
+# ### Fast Inpaint
+#
+# Same algorithm as `inpaint`, pixel for pixel, but:
+#
+# * Only the bounding box of the mask (plus a 2px halo, the farthest `_solve`
+#   reaches) is visited. Everything outside is KNOWN with `D = 0` and never changes.
+# * `F`, `D` and pixel data are flat `array`s indexed by `y * width + x`.
+# * The narrow band is an index based binary heap with a position table, so
+#   a pixel is updated in place instead of leaving a tombstone behind.
+#   Ties are broken by push order, exactly like `PriorityQueue`.
+from array import array
+
+FMM_KNOWN = 0
+FMM_BAND = 1
+FMM_INSIDE = 255
+FMM_HALO = 2
+
+class IndexHeap:
+    def __init__(self, size):
+        self._heap = array('i')
+        self._pos = array('i', [-1]) * size
+        self._priority = array('d', [0.0]) * size
+        self._order = array('l', [0]) * size
+        self._counter = 0
+
+    def __len__(self):
+        return len(self._heap)
+
+    def empty(self):
+        return len(self._heap) == 0
+
+    def _less(self, a, b):
+        pa = self._priority[a]
+        pb = self._priority[b]
+        return pa < pb or (pa == pb and self._order[a] < self._order[b])
+
+    def _move(self, slot, i):
+        self._heap[slot] = i
+        self._pos[i] = slot
+
+    def _sift_up(self, slot):
+        heap = self._heap
+        i = heap[slot]
+        while slot > 0:
+            parent = (slot - 1) >> 1
+            if not self._less(i, heap[parent]):
+                break
+            self._move(slot, heap[parent])
+            slot = parent
+        self._move(slot, i)
+
+    def _sift_down(self, slot):
+        heap = self._heap
+        size = len(heap)
+        i = heap[slot]
+        while True:
+            child = 2 * slot + 1
+            if child >= size:
+                break
+            if child + 1 < size and self._less(heap[child + 1], heap[child]):
+                child += 1
+            if not self._less(heap[child], i):
+                break
+            self._move(slot, heap[child])
+            slot = child
+        self._move(slot, i)
+
+    def push(self, priority, i):
+        self._priority[i] = priority
+        self._order[i] = self._counter
+        self._counter += 1
+        slot = self._pos[i]
+        if slot < 0:
+            self._heap.append(i)
+            self._sift_up(len(self._heap) - 1)
+        else:
+            self._sift_up(slot)
+            self._sift_down(self._pos[i])
+
+    def pop(self):
+        heap = self._heap
+        top = heap[0]
+        last = heap.pop()
+        self._pos[top] = -1
+        if len(heap) > 0:
+            self._move(0, last)
+            self._sift_down(0)
+        return top
+
+def _fmm_solve(F, D, i1, i2):
+    # i1, i2 are -1 when out of bounds
+    sol = float('inf')
+    if i1 >= 0 and F[i1] == FMM_KNOWN:
+        t1 = D[i1]
+        if i2 >= 0 and F[i2] == FMM_KNOWN:
+            t2 = D[i2]
+            r = math.sqrt(2 * (t1 - t2) * (t1 - t2))
+            s = (t1 + t2 * r) / 2
+            if s >= t1 and s >= t2:
+                sol = s
+            else:
+                s += r
+                if s >= t1 and s >= t2:
+                    sol = s
+        else:
+            sol = 1 + t1
+    elif i2 >= 0 and F[i2] == FMM_KNOWN:
+        sol = 1 + D[i2]
+    return sol
+
+def _fmm_inpaint(F, P, data, i, x, y, width, height):
+    total = 0
+    count = 0
+    for d in BOX_3:
+        if d[0] == 0 and d[1] == 0:
+            continue
+        nx = x + d[0]
+        ny = y + d[1]
+        if nx < 0 or ny < 0 or nx >= width or ny >= height:
+            continue
+        ni = i + d[1] * width + d[0]
+        # KNOWN point cannot be 0, see `inpaint`
+        if F[ni] == FMM_KNOWN and P[ni] != 0:
+            total += P[ni]
+            count += 1
+    if count != 0:
+        data[i] = total / count
+
+def fast_inpaint(image, mask):
+    dst = Image.new('P', image.size)
+    dst.putpalette(RADAR_PALETTE)
+    dst.paste(image, (0, 0))
+    bbox = mask.getbbox()
+    if not bbox:
+        return dst
+    # Window in image coordinates
+    x0 = max(bbox[0] - FMM_HALO, 0)
+    y0 = max(bbox[1] - FMM_HALO, 0)
+    x1 = min(bbox[2] + FMM_HALO, image.size[0])
+    y1 = min(bbox[3] + FMM_HALO, image.size[1])
+    box = (x0, y0, x1, y1)
+    width = x1 - x0
+    height = y1 - y0
+    size = width * height
+
+    P = array('B', image.crop(box).getdata())
+    M = array('B', mask.crop(box).getdata())
+    data = array('B', P)
+    F = array('B', [FMM_KNOWN]) * size
+    D = array('d', [0.0]) * size
+    narrow_band = IndexHeap(size)
+    inf = float('inf')
+
+    # Init mask
+    for i in xrange(size):
+        if M[i] != 1:
+            continue
+        data[i] = 0
+        x = i % width
+        y = i // width
+        n_total = 0
+        n_unknown = 0
+        for d in CROSS_3:
+            nx = x + d[0]
+            ny = y + d[1]
+            if nx < 0 or ny < 0 or nx >= width or ny >= height:
+                continue
+            n_total += 1
+            if M[i + d[1] * width + d[0]] != 0:
+                n_unknown += 1
+        if n_total > 0 and n_total == n_unknown:
+            F[i] = FMM_INSIDE
+            D[i] = inf
+        else:
+            _fmm_inpaint(F, P, data, i, x, y, width, height)
+            narrow_band.push(0.0, i)
+            F[i] = FMM_BAND
+
+    # Inpaint narrow band
+    while not narrow_band.empty():
+        c = narrow_band.pop()
+        F[c] = FMM_KNOWN
+        cx = c % width
+        cy = c // width
+        for d in CROSS_3:
+            nx = cx + d[0]
+            ny = cy + d[1]
+            if nx < 0 or ny < 0 or nx >= width or ny >= height:
+                continue
+            ni = c + d[1] * width + d[0]
+            left = ni - 1 if nx > 0 else -1
+            right = ni + 1 if nx < width - 1 else -1
+            up = ni - width if ny > 0 else -1
+            down = ni + width if ny < height - 1 else -1
+            D[ni] = min([
+                _fmm_solve(F, D, left, up),
+                _fmm_solve(F, D, right, up),
+                _fmm_solve(F, D, left, down),
+                _fmm_solve(F, D, right, down)
+            ])
+            if F[ni] == FMM_INSIDE:
+                F[ni] = FMM_BAND
+                _fmm_inpaint(F, P, data, ni, nx, ny, width, height)
+                narrow_band.push(D[ni], ni)
+
+    patch = Image.new('P', (width, height))
+    patch.putdata(data)
+    dst.paste(patch, (x0, y0))
+    return dst
+
 from cStringIO import StringIO
-import base64
 import logging
 
 def run_crop_only(image):
@@ -367,17 +681,47 @@ def run_crop_only(image):
   logging.info("Finish cropping frame")
   output = StringIO()
   final.save(output, format = 'PNG', transparency = 0)
-  return base64.encodestring(output.getvalue())
-
-def run(image):
+  # PNG bytes, encoded only when uploaded
+  return output.getvalue()
+
+def process_frame(image, backend = None, roi = True):
+  if backend == None:
+    backend = DEFAULT_BACKEND
+  frame = crop(image)
+  if roi:
+    box = get_roi(frame)
+  else:
+    box = (0, 0) + frame.size
+  final = Image.new('P', frame.size)
+  final.putpalette(RADAR_PALETTE)
+  if box:
+    radar, mask = BACKENDS[backend](frame.crop(box))
+    final.paste(fast_inpaint(radar, mask), box[:2])
+  return final
+
+def run(image, backend = None, roi = True):
   logging.info("Start processing frame")
-  border, radar = extract_borders(crop(image))
-  mask = get_inpaint_mask(radar, border)
-  final = inpaint(radar, mask)
+  final = process_frame(image, backend, roi)
   logging.info("Finish processing frame")
   output = StringIO()
   final.save(output, format = 'PNG', transparency = 0)
-  return base64.encodestring(output.getvalue())
+  # PNG bytes, encoded only when uploaded
+  return output.getvalue()
+
+def run_data(data):
+  # Downloaded GIF bytes -> PNG bytes
+  return run(Image.open(StringIO(data)))
+
+def run_batch(datas):
+  # In a worker of process_pool.FramePool: (True, PNG bytes) or (False, error)
+  # for every frame, so that a bad frame doesn't fail the others
+  results = []
+  for data in datas:
+    try:
+      results.append((True, run_data(data)))
+    except Exception as e:
+      results.append((False, "%s: %s" % (e.__class__.__name__, e)))
+  return results
 
 if __name__ == '__main__':
   import urllib2
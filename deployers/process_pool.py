@@ -0,0 +1,119 @@
+try:
+  import multiprocessing
+except ImportError:
+  multiprocessing = None
+import logging
+import threading
+import Queue
+import process
+
+# Frame processing is pure Python for the most part, so threads running
+# process.run take turns on the GIL. FramePool hands the GIF bytes to worker
+# processes instead, chunk_size frames per task to spread the pickling and
+# round trip, and gives the PNG bytes back to the calling thread.
+#
+# With no workers, or where there is no multiprocessing (App Engine), frames
+# are processed in the calling thread as before.
+
+# Put once to stop the batching thread
+STOP = object()
+# Seconds to wait for more frames to fill a chunk
+BATCH_WAIT = 0.05
+
+class ProcessError(Exception):
+  pass
+
+class FramePool(object):
+  def __init__(self, workers = 0, chunk_size = 4, timeout = 60):
+    self.workers = workers
+    self.chunk_size = max(chunk_size, 1)
+    self.timeout = timeout
+    self._pool = None
+    if workers > 0 and multiprocessing:
+      try:
+        self._pool = multiprocessing.Pool(workers)
+      except (OSError, ImportError, NotImplementedError) as e:
+        logging.warning("No process pool (%s), processing frames in threads" % (e))
+    elif workers > 0:
+      logging.warning("multiprocessing not available, processing frames in threads")
+    # Metrics
+    self._lock = threading.Lock()
+    self.chunk_count = 0
+    self.frame_count = 0
+    self.fallback_count = 0
+    if self._pool:
+      # [data, done, result] waiting to be sent to a worker
+      self._pending = Queue.Queue()
+      self._batcher = threading.Thread(target = self._batch)
+      self._batcher.daemon = True
+      self._batcher.start()
+
+  @property
+  def parallel(self):
+    return self._pool != None
+
+  @property
+  def max_thread(self):
+    # Threads calling run() to keep every worker busy with full chunks
+    return self.workers * self.chunk_size if self._pool else None
+
+  def run(self, data):
+    # GIF bytes -> PNG bytes
+    if not self._pool:
+      return process.run_data(data)
+    request = [data, threading.Event(), None]
+    self._pending.put(request)
+    if not request[1].wait(self.timeout):
+      # A worker died with the chunk, or is stuck
+      logging.warning("No result from the process pool in %ds, processing in thread" % (self.timeout))
+      with self._lock:
+        self.fallback_count += 1
+      return process.run_data(data)
+    succ, result = request[2]
+    if not succ:
+      raise ProcessError(result)
+    return result
+
+  def _batch(self):
+    while True:
+      request = self._pending.get()
+      if request is STOP:
+        break
+      chunk = [request]
+      while len(chunk) < self.chunk_size:
+        try:
+          request = self._pending.get(timeout = BATCH_WAIT)
+        except Queue.Empty:
+          break
+        if request is STOP:
+          self._send(chunk)
+          return
+        chunk.append(request)
+      self._send(chunk)
+
+  def _send(self, chunk):
+    self.chunk_count += 1
+    self.frame_count += len(chunk)
+    callback = lambda results: self._done(chunk, results)
+    self._pool.apply_async(process.run_batch, ([request[0] for request in chunk],), callback = callback)
+
+  def _done(self, chunk, results):
+    for request, result in zip(chunk, results):
+      request[2] = result
+      request[1].set()
+
+  def close(self):
+    if not self._pool:
+      return
+    self._pending.put(STOP)
+    self._batcher.join()
+    if self.fallback_count:
+      # A chunk never came back, join() would wait for it forever
+      logging.warning("Process pool lost chunks, terminate workers")
+      self._pool.terminate()
+    else:
+      # Every run() got its result, workers are idle
+      self._pool.close()
+    self._pool.join()
+    logging.info("Process pool: %d frames in %d chunks on %d workers, %d processed in thread" % (
+      self.frame_count, self.chunk_count, self.workers, self.fallback_count))
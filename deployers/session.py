@@ -0,0 +1,86 @@
+import os
+import json
+import logging
+import tempfile
+from datetime import datetime
+
+try:
+  from google.appengine.ext import ndb
+except ImportError:
+  ndb = None
+
+# What GitHubDeployer.auth() resolved last time, so that the next run (on any
+# instance) can skip logging in every account and walking orgs and teams
+class Session(object):
+  FIELDS = ['username', 'org', 'team_id', 'repo', 'branch']
+
+  def __init__(self, username, org, team_id, repo, branch):
+    self.username = username
+    self.org = org
+    self.team_id = team_id
+    self.repo = repo
+    self.branch = branch
+
+  def matches(self, config):
+    return self.org == config.ORG_NAME and self.repo == config.REPO_NAME and self.branch == config.BRANCH
+
+  def to_dict(self):
+    return dict((f, getattr(self, f)) for f in self.FIELDS)
+
+  @classmethod
+  def from_dict(cls, d):
+    return cls(*[d.get(f) for f in cls.FIELDS])
+
+class FileSessionStore(object):
+  def __init__(self, path = None):
+    if path == None:
+      path = os.path.join(tempfile.gettempdir(), 'radar-bot-github-session.json')
+    self.path = path
+
+  def load(self):
+    try:
+      with open(self.path) as f:
+        return Session.from_dict(json.load(f))
+    except (IOError, ValueError):
+      return None
+
+  def save(self, session):
+    with open(self.path, 'w') as f:
+      json.dump(session.to_dict(), f)
+
+  def clear(self):
+    if os.path.exists(self.path):
+      os.remove(self.path)
+
+if ndb:
+  class GitHubSession(ndb.Model):
+    username = ndb.StringProperty()
+    org = ndb.StringProperty()
+    team_id = ndb.IntegerProperty()
+    repo = ndb.StringProperty()
+    branch = ndb.StringProperty()
+    updated = ndb.DateTimeProperty()
+
+  # ndb keeps entities in memcache, so loading is usually a memcache hit
+  class NdbSessionStore(object):
+    def __init__(self, id = 'default'):
+      self.key = ndb.Key(GitHubSession, id)
+
+    def load(self):
+      entity = self.key.get()
+      if not entity:
+        return None
+      return Session(entity.username, entity.org, entity.team_id, entity.repo, entity.branch)
+
+    def save(self, session):
+      entity = GitHubSession(key = self.key, updated = datetime.now(), **session.to_dict())
+      entity.put()
+
+    def clear(self):
+      self.key.delete()
+
+def default_store():
+  if ndb:
+    return NdbSessionStore()
+  logging.warning("Datastore not available, keep GitHub session in a local file")
+  return FileSessionStore()
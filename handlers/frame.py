@@ -3,53 +3,76 @@ from models import *
 from crawler import *
 from datetime import datetime
 from deployers import *
+from deployers.frame_index import default_index, publish_cadence
 import logging
 import re
+import time
 import config
 MAX_FRAME_PER_CRON = 5
-
-class ImageCrawlerThread(CrawlerThread):
-  def init(self):
-    self.max_frame_count = MAX_FRAME_PER_CRON
-  def should_walk(self, url, urls, context):
-    if len(urls) >= self.max_frame_count:
-      return False
-    # TODO: check time stamp
-    return True
-
-IMG_URL_RE = "javascript:view_text_img\((\'.*?\'),(\'.*?\'),'','','','',(\'.*?\'),'',(\'.*?\'),'',''\)"
-IMG_ENLARGE_RE = "(http:\/\/image\.weather\.gov\.cn)(.*)"
-
-# 1: Url
-# 2: Station ID
-# 3: YYYYMMDDHHmm or "%Y%m%d%H%M"
-# 4: YYYY
-# 5: MM
-# 6: DD
-# 7: HHmm
-TIME_STAMP_RE = "'?(\/product\/\d{4}\/\d{6}\/\d{8}\/RDCP\/SEVP_AOC_RDCP_SLDAS_EBREF_AZ(\d{4})_L88_PI_((\d{4})(\d{2})(\d{2})(\d{4})).*)'?"
-TIME_STAMP_FORMAT = "%Y%m%d%H%M"
+# Stations crawled in one run at most, the least stale ones are left out
+MAX_FRONTIER = 500
+# Frames read to guess how often a station publishes
+CADENCE_SAMPLE = 10
+# Radars publish every 6 minutes
+DEFAULT_CADENCE = 6 * 60
+# Seconds of the request deadline given to the crawl, the rest is for the deploy
+FRAME_CRAWL_BUDGET = 4 * 60
 
 def extract_frame_info(script_url):
-  url = script_url
   # Extract url with ''
-  m = re.match(IMG_URL_RE, url)
-  if not m:
-    m = re.match(IMG_ENLARGE_RE, url)
-  if not m:
+  index, groups = FRAME_LINK_RULES.match_groups(script_url)
+  if index == None:
     return
-  url = m.group(2)
+  url = groups[1]
   # Extract url and date time
-  m = re.match(TIME_STAMP_RE, url)
+  m = TIME_STAMP_PATTERN.match(url)
+  if not m:
+    return
   url = m.group(1)
   timestamp = m.group(3)
   time = datetime.strptime(timestamp, TIME_STAMP_FORMAT)
   station_id = m.group(2)
   return (url, time, station_id, timestamp)
 
+class ImageCrawlerThread(CrawlerThread):
+  # No new frame on a station page is fine
+  empty_is_failure = False
+
+  def init(self):
+    self.max_frame_count = MAX_FRAME_PER_CRON
+
+  def walk_page(self, page, url, context):
+    # Context: station of the page
+    last_update = context.last_update
+    urls = []
+    for link in page:
+      info = extract_frame_info(link)
+      if not info:
+        continue
+      # Frames are listed newest first, the rest are deployed already
+      if last_update != None and info[1] <= last_update:
+        break
+      urls.append(link.encode('utf-8'))
+      if len(urls) >= self.max_frame_count:
+        break
+    return urls
+
+def staleness_priority(task):
+  # Frames a station is expected to have published since its last update,
+  # negated so that the stalest station comes first
+  station = task[2]
+  if station.last_update == None:
+    return float('-inf')
+  age = (datetime.now() - station.last_update).total_seconds()
+  return -age / (getattr(station, 'cadence', None) or DEFAULT_CADENCE)
+
 class ImageCrawler(Crawler):
+  # Only hrefs are needed, don't build the tree
+  link_extractor = staticmethod(scan_links)
+
   def __init__(self):
-    Crawler.__init__(self, [IMG_URL_RE, IMG_ENLARGE_RE], [], 1, 10, ImageCrawlerThread)
+    Crawler.__init__(self, [IMG_URL_RE, IMG_ENLARGE_RE], [], 1, 10, ImageCrawlerThread, engine = getattr(config, 'CRAWLER_ENGINE', 'thread'),
+      queue = Frontier(staleness_priority, MAX_FRONTIER))
     self.results = {}
     self.new_frame_count = 0
 
@@ -78,17 +101,13 @@ class ImageCrawler(Crawler):
         frame = Frame.create_from_frame_info(station, r)
         self.results[id].append(frame)
 
-      # Keep track of newst frame in this update
-      # and set to station.last_update later
-      if station._this_update < t:
-        station._this_update = t
-
 
 class FrameTaskHandler(TaskHandler):
   def get_name(self):
     return 'frame'
 
   def run_task(self):
+    start = time.time()
     # Query station list
     query = Station.create_query_for_all()
     station_count = query.count()
@@ -118,31 +137,46 @@ class FrameTaskHandler(TaskHandler):
     task_chunk = tasks[chunk_start:chunk_end]
     #task_chunk = task_chunk[0:1]
     station_chunk = {}
+    # The frame index knows what is actually deployed
+    frame_index = default_index()
+    recent_frames = frame_index.newest_multi([task[1].station_id for task in task_chunk], CADENCE_SAMPLE)
     for task in task_chunk:
       station = task[1]
+      recent = recent_frames[station.station_id]
+      station.last_update = recent[0][0] if recent else None
+      station.cadence = publish_cadence(recent)
       station_chunk[station.station_id] = station
 
     # Start crawler
     logging.info("Start frame crawler for %d stations" % (len(task_chunk)))
     crawler = ImageCrawler()
     crawler.stations = station_chunk
+    crawler.page_cache = NdbPageCache()
+    # Stalest stations first, no new ones once the budget is used up
+    crawler.deadline = start + getattr(config, 'FRAME_CRAWL_BUDGET', FRAME_CRAWL_BUDGET)
     crawler.walk_with_context(task_chunk)
+    if crawler.queue.dropped:
+      logging.warning("Frontier full, %d stations left out" % (len(crawler.queue.dropped)))
     if crawler.fail_count > 0:
       logging.warning("%d tasks failed" % (crawler.fail_count))
     logging.info("Find %d frames, %d new since last update" % (len(crawler.urls), crawler.new_frame_count))
 
     # Deploy
     logging.info("Start deploying")
-    deployer = GitHubDeployer(crawler.results)
+    deployer = GitHubDeployer(crawler.results, frame_index = frame_index)
     deployed = deployer.deploy()
     logging.info("Update stations in datastore")
-    for station in station_chunk.values():
-      if station._this_update != None:
-        station.last_update = station._this_update
+    for station_id in crawler.results:
+      station = station_chunk[station_id]
+      station.last_update = frame_index.last_update(station_id)
 
     # Put changes
     if deployed:
       ndb.put_multi(station_chunk.values())
+      # Frames of these pages are deployed, they can be skipped next time.
+      # Stations with frames but no tree are crawled again
+      crawler.page_cache.commit([task[0] for task in task_chunk
+        if task[1].station_id not in crawler.results or task[1].station_id in deployer.deployed_stations])
       self.response.set_status(200)
     else:
       logging.error("Deploy failed")
@@ -4,22 +4,13 @@ from models import *
 from deployers import *
 import xml.etree.ElementTree as ET
 import json
+import config
 #from google.appengine.api import logservice
 #import logging
 
 start_url = 'http://www.nmc.gov.cn/publish/radar/beijing.htm'
-STATION_RE = "(http:\\/\\/www\\.nmc\\.gov\\.cn\\/publish\\/radar\\/)"
-IMAGE_RE = "http:\/\/image\.weather\.gov\.cn(.*)"
-# 1: Url
-# 2: Station ID
-# 3: YYYYMMDDHHmm or "%Y%m%d%H%M"
-# 4: YYYY
-# 5: MM
-# 6: DD
-# 7: HHmm
-TIME_STAMP_RE = "(\/product\/\d{4}\/\d{6}\/\d{8}\/RDCP\/SEVP_AOC_RDCP_SLDAS_EBREF_AZ(\d{4})_L88_PI_((\d{4})(\d{2})(\d{2})(\d{4})).*)"
 white_rules = [STATION_RE]
-black_rules = ['(http:\\/\\/www\\.nmc\\.gov\\.cn\\/publish\\/radar\\/)(chinaall|stationindex)\\.htm']
+black_rules = [STATION_INDEX_RE]
 
 
 class StationCrawlerThread(CrawlerThread):
@@ -28,11 +19,11 @@ class StationCrawlerThread(CrawlerThread):
       self.crawler.station_id_table = {}
 
   def should_walk(self, url, urls, context):
-    if re.match(URL_RE, url):
+    index, groups = STATION_LINK_RULES.match_groups(url)
+    if index == 0:
       return True
-    m = re.match(IMAGE_RE, url)
-    if m:
-      m = re.match(TIME_STAMP_RE, m.group(1))
+    if index == 1:
+      m = TIME_STAMP_PATTERN.match(groups[0])
       if m:
         id = m.group(2)
         name = get_name_from_url(context)
@@ -56,7 +47,7 @@ class StationTaskHandler(TaskHandler):
     logging.info("Loading station information")
     station_info = self.read_station_info()
     logging.info("Create crawler")
-    crawler = Crawler(white_rules, black_rules, 3, thread_klass = StationCrawlerThread)
+    crawler = Crawler(white_rules, black_rules, 3, thread_klass = StationCrawlerThread, normalize_urls = True, engine = getattr(config, 'CRAWLER_ENGINE', 'thread'))
     logging.info("Start walking")
     crawler.walk([start_url])
     logging.info("Walking finished")
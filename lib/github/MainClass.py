@@ -135,6 +135,30 @@ class Github(object):
         )
         return RateLimit.RateLimit(self.__requester, headers, attributes, True)
 
+    @property
+    def connection_pool(self):
+        """
+        Persistent connections shared by all instances, with counters for reuses and new handshakes.
+        :type: :class:`github.Requester.ConnectionPool`
+        """
+        return self.__requester.connectionPool
+
+    @property
+    def response_cache(self):
+        """
+        Cache for conditional GET requests shared by all instances, None when disabled.
+        :type: :class:`github.Requester.ResponseCache`
+        """
+        return self.__requester.responseCache
+
+    @staticmethod
+    def set_response_cache(cache):
+        """
+        Enables conditional GET requests for all instances, or disables them with None.
+        :param cache: :class:`github.Requester.ResponseCache`
+        """
+        Requester.setResponseCache(cache)
+
     @property
     def oauth_scopes(self):
         """
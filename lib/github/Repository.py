@@ -31,6 +31,7 @@
 
 import urllib
 import datetime
+import binascii
 
 import github.GithubObject
 import github.PaginatedList
@@ -692,6 +693,28 @@ class Repository(github.GithubObject.CompletableGithubObject):
         )
         return github.GitBlob.GitBlob(self._requester, headers, data, completed=True)
 
+    def create_git_blob_from_data(self, data):
+        """
+        :calls: `POST /repos/:owner/:repo/git/blobs <http://developer.github.com/v3/git/blobs>`_
+        :param data: string, raw content, sent base64 encoded
+        :rtype: :class:`github.GitBlob.GitBlob`
+
+        Same as create_git_blob(base64 content, "base64"), without building the
+        JSON body: the content is encoded once, unwrapped, and the request is
+        written around it.
+        """
+        assert isinstance(data, str), type(data)
+        encoded = binascii.b2a_base64(data)
+        # Without the trailing newline of b2a_base64, and without copying
+        content = memoryview(encoded)[:-1]
+        headers, output = self._requester.requestStreamAndCheck(
+            "POST",
+            self.url + "/git/blobs",
+            "application/json",
+            ['{"encoding": "base64", "content": "', content, '"}']
+        )
+        return github.GitBlob.GitBlob(self._requester, headers, output, completed=True)
+
     def create_git_commit(self, message, tree, parents, author=github.GithubObject.NotSet, committer=github.GithubObject.NotSet):
         """
         :calls: `POST /repos/:owner/:repo/git/commits <http://developer.github.com/v3/git/commits>`_
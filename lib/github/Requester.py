@@ -33,11 +33,16 @@
 # ##############################################################################
 
 import logging
+import errno
 import httplib
 import base64
 import urllib
 import urlparse
 import sys
+import socket
+import threading
+import hashlib
+import collections
 import Consts
 import re
 
@@ -52,7 +57,153 @@ else:  # pragma no cover (Covered by all tests with Python 2.5)
 import GithubException
 
 
+class ConnectionPool:
+    '''
+    Keeps idle persistent connections per (connection class, host, port), so that
+    consecutive requests reuse the socket (and its TLS session) instead of opening
+    a new one. Connections are checked out exclusively, so a pool can be shared by
+    any number of threads.
+    '''
+
+    def __init__(self, maxIdlePerHost=10):
+        self.maxIdlePerHost = maxIdlePerHost
+        self.__lock = threading.Lock()
+        self.__idle = dict()
+        self.reuses = 0
+        self.handshakes = 0
+        self.reconnects = 0
+
+    def acquire(self, key, factory):
+        '''
+        Returns (connection, reused), creating a connection with factory if no idle one is available
+        '''
+        with self.__lock:
+            idle = self.__idle.get(key)
+            if idle:
+                self.reuses += 1
+                return idle.pop(), True
+            self.handshakes += 1
+        return factory(), False
+
+    def release(self, key, cnx):
+        with self.__lock:
+            idle = self.__idle.setdefault(key, [])
+            if len(idle) < self.maxIdlePerHost:
+                idle.append(cnx)
+                return
+        cnx.close()
+
+    def discard(self, cnx, reconnect=False):
+        cnx.close()
+        if reconnect:
+            with self.__lock:
+                self.reconnects += 1
+
+    def clear(self):
+        with self.__lock:
+            idle = self.__idle
+            self.__idle = dict()
+        for connections in idle.values():
+            for cnx in connections:
+                cnx.close()
+
+    @property
+    def stats(self):
+        '''
+        :type: dict with reuses, handshakes, reconnects and idle connection count
+        '''
+        with self.__lock:
+            return {
+                "reuses": self.reuses,
+                "handshakes": self.handshakes,
+                "reconnects": self.reconnects,
+                "idle": sum(len(connections) for connections in self.__idle.values()),
+            }
+
+
+class ResponseCache:
+    '''
+    Bounded LRU cache of GET responses carrying an ETag or Last-Modified header,
+    keyed by (verb, url, authentication identity). Cached entries are replayed as
+    conditional requests, and a 304 answer is served from the cache (GitHub does
+    not count those against the rate limit). Thread safe.
+    '''
+
+    def __init__(self, maxSize=256):
+        self.maxSize = maxSize
+        self.__lock = threading.Lock()
+        self.__entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self.__lock:
+            entry = self.__entries.pop(key, None)
+            if entry is not None:
+                self.__entries[key] = entry
+            return entry
+
+    def put(self, key, responseHeaders, output):
+        with self.__lock:
+            self.__entries.pop(key, None)
+            self.__entries[key] = (responseHeaders, output)
+            while len(self.__entries) > self.maxSize:
+                self.__entries.popitem(last=False)
+                self.evictions += 1
+
+    def record(self, hit):
+        with self.__lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def clear(self):
+        with self.__lock:
+            self.__entries.clear()
+
+    def __len__(self):
+        return len(self.__entries)
+
+    @property
+    def stats(self):
+        '''
+        :type: dict with hits, misses, evictions and entry count
+        '''
+        with self.__lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "size": len(self.__entries),
+            }
+
+
+class StreamedBody:
+    '''
+    Request body made of chunks (strings or buffers) that are written to the
+    connection one after the other, so a large body is never joined into one
+    string. Chunks must stay readable until the request is done, since a
+    request failing on a stale connection is sent again.
+    '''
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.length = sum(len(chunk) for chunk in chunks)
+
+    def __str__(self):
+        return "(%d bytes in %d chunks)" % (self.length, len(self.chunks))
+
+
 class Requester:
+    connectionPool = ConnectionPool()
+    responseCache = None
+
+    @classmethod
+    def setResponseCache(cls, cache):
+        cls.responseCache = cache
+
     __httpConnectionClass = httplib.HTTPConnection
     __httpsConnectionClass = httplib.HTTPSConnection
 
@@ -137,6 +288,8 @@ class Requester:
             self.__authorizationHeader = "token " + token
         else:
             self.__authorizationHeader = None
+        # Identifies the credentials in cache keys without keeping them in clear
+        self.__identity = hashlib.sha1(self.__authorizationHeader or "").hexdigest()
 
         self.__base_url = base_url
         o = urlparse.urlparse(base_url)
@@ -168,6 +321,9 @@ class Requester:
     def requestJsonAndCheck(self, verb, url, parameters=None, headers=None, input=None, cnx=None):
         return self.__check(*self.requestJson(verb, url, parameters, headers, input, cnx))
 
+    def requestStreamAndCheck(self, verb, url, contentType, chunks):
+        return self.__check(*self.requestStream(verb, url, contentType, chunks))
+
     def requestMultipartAndCheck(self, verb, url, parameters=None, headers=None, input=None):
         return self.__check(*self.requestMultipart(verb, url, parameters, headers, input))
 
@@ -209,6 +365,12 @@ class Requester:
 
         return self.__requestEncode(cnx, verb, url, parameters, headers, input, encode)
 
+    def requestStream(self, verb, url, contentType, chunks):
+        def encode(input):
+            return contentType, StreamedBody(input)
+
+        return self.__requestEncode(None, verb, url, None, None, chunks, encode)
+
     def requestMultipart(self, verb, url, parameters=None, headers=None, input=None):
         def encode(input):
             boundary = "----------------------------3c3ba8b523b2"
@@ -238,14 +400,41 @@ class Requester:
         url = self.__makeAbsoluteUrl(url)
         url = self.__addParametersToUrl(url, parameters)
 
-        encoded_input = "null"
+        encoded_input = None
         if input is not None:
             requestHeaders["Content-Type"], encoded_input = encode(input)
 
+        cache = self.responseCache
+        if verb != "GET" or cnx is not None or Consts.REQ_IF_NONE_MATCH in requestHeaders or Consts.REQ_IF_MODIFIED_SINCE in requestHeaders:
+            # Callers doing their own conditional requests (GithubObject.update) need the real 304
+            cache = None
+        cacheKey = None
+        cached = None
+        if cache is not None:
+            cacheKey = (verb, url, self.__identity)
+            cached = cache.get(cacheKey)
+            if cached is not None:
+                cachedHeaders = cached[0]
+                if "etag" in cachedHeaders:
+                    requestHeaders[Consts.REQ_IF_NONE_MATCH] = cachedHeaders["etag"]
+                if "last-modified" in cachedHeaders:
+                    requestHeaders[Consts.REQ_IF_MODIFIED_SINCE] = cachedHeaders["last-modified"]
+
         self.NEW_DEBUG_FRAME(requestHeaders)
 
         status, responseHeaders, output = self.__requestRaw(cnx, verb, url, requestHeaders, encoded_input)
 
+        if cache is not None:
+            if status == 304 and cached is not None:
+                cache.record(True)
+                headers = dict(cached[0])
+                headers.update(responseHeaders)
+                status, responseHeaders, output = 200, headers, cached[1]
+            else:
+                cache.record(False)
+                if status == 200 and ("etag" in responseHeaders or "last-modified" in responseHeaders):
+                    cache.put(cacheKey, responseHeaders, output)
+
         if "x-ratelimit-remaining" in responseHeaders and "x-ratelimit-limit" in responseHeaders:
             self.rate_limiting = (int(responseHeaders["x-ratelimit-remaining"]), int(responseHeaders["x-ratelimit-limit"]))
         if "x-ratelimit-reset" in responseHeaders:
@@ -260,27 +449,69 @@ class Requester:
 
     def __requestRaw(self, cnx, verb, url, requestHeaders, input):
         if cnx is None:
-            cnx = self.__createConnection()
+            status, responseHeaders, output = self.__requestPooled(verb, url, requestHeaders, input)
         else:
             assert cnx == "status"
             cnx = self.__httpsConnectionClass("status.github.com", 443)
-        cnx.request(
-            verb,
-            url,
-            input,
-            requestHeaders
-        )
+            status, responseHeaders, output, willClose = self.__requestOnce(cnx, verb, url, requestHeaders, input)
+            cnx.close()
+
+        self.__log(verb, url, requestHeaders, input, status, responseHeaders, output)
+
+        return status, responseHeaders, output
+
+    def __requestOnce(self, cnx, verb, url, requestHeaders, input):
+        if isinstance(input, StreamedBody):
+            cnx.putrequest(verb, url)
+            for name, value in requestHeaders.iteritems():
+                cnx.putheader(name, value)
+            cnx.putheader("Content-Length", str(input.length))
+            cnx.endheaders()
+            for chunk in input.chunks:
+                cnx.send(chunk)
+        else:
+            cnx.request(
+                verb,
+                url,
+                input,
+                requestHeaders
+            )
         response = cnx.getresponse()
 
         status = response.status
         responseHeaders = dict((k.lower(), v) for k, v in response.getheaders())
         output = response.read()
 
-        cnx.close()
-
-        self.__log(verb, url, requestHeaders, input, status, responseHeaders, output)
+        return status, responseHeaders, output, response.will_close
 
-        return status, responseHeaders, output
+    def __requestPooled(self, verb, url, requestHeaders, input):
+        pool = self.connectionPool
+        key = (self.__connectionClass, self.__hostname, self.__port)
+        while True:
+            cnx, reused = pool.acquire(key, self.__createConnection)
+            try:
+                status, responseHeaders, output, willClose = self.__requestOnce(cnx, verb, url, requestHeaders, input)
+            except (httplib.HTTPException, socket.error), e:
+                # An idle connection may have been closed by the server: retry on another one
+                pool.discard(cnx, reconnect=reused)
+                if reused and self.__isStaleConnection(verb, e):
+                    continue
+                raise
+            if willClose:
+                pool.discard(cnx)
+            else:
+                pool.release(key, cnx)
+            return status, responseHeaders, output
+
+    def __isStaleConnection(self, verb, e):
+        # Only sent again when the server can't have applied the request
+        if verb == "GET":
+            return True
+        if isinstance(e, (httplib.BadStatusLine, httplib.ImproperConnectionState)):
+            return True
+        if isinstance(e, socket.timeout):
+            return False
+        return isinstance(e, socket.error) and e.errno in (errno.ECONNRESET, errno.EPIPE)
 
     def __authenticate(self, url, requestHeaders, parameters):
         if self.__clientId and self.__clientSecret and "client_id=" not in url:
@@ -38,6 +38,7 @@ from GithubException import GithubException, BadCredentialsException, UnknownObj
 from InputFileContent import InputFileContent
 from InputGitAuthor import InputGitAuthor
 from InputGitTreeElement import InputGitTreeElement
+from Requester import ResponseCache
 
 
 def enable_console_debug_logging():  # pragma no cover (Function useful only outside test environment)
@@ -1,2 +1,4 @@
+from patterns import *
 from station import *
 from frame import *
+from page import *
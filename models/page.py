@@ -0,0 +1,20 @@
+from google.appengine.ext import ndb
+from crawler.page_cache import Fingerprint, MemoryPageCache
+
+class PageFingerprint(ndb.Model):
+  # Key: PageFingerprint(url)
+  etag = ndb.StringProperty(indexed = False)
+  last_modified = ndb.StringProperty(indexed = False)
+  digest = ndb.StringProperty(indexed = False)
+  updated = ndb.DateTimeProperty(auto_now = True)
+
+# Page cache shared by every task instance, loaded in one batch per crawl
+class NdbPageCache(MemoryPageCache):
+  def load(self, urls):
+    keys = [ndb.Key(PageFingerprint, url) for url in urls]
+    for url, page in zip(urls, ndb.get_multi(keys)):
+      if page:
+        self._pages[url] = Fingerprint(page.etag, page.last_modified, page.digest)
+
+  def save(self, pages):
+    ndb.put_multi([PageFingerprint(id = url, etag = f.etag, last_modified = f.last_modified, digest = f.digest) for url, f in pages.iteritems()])
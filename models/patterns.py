@@ -0,0 +1,33 @@
+import re
+from crawler.rules import RuleSet
+
+# Urls of www.nmc.gov.cn and image.weather.gov.cn, compiled once and shared by
+# the crawlers and models
+
+# Any page under the radar section
+STATION_RE = "(http:\\/\\/www\\.nmc\\.gov\\.cn\\/publish\\/radar\\/)"
+STATION_INDEX_RE = "(http:\\/\\/www\\.nmc\\.gov\\.cn\\/publish\\/radar\\/)(chinaall|stationindex)\\.htm"
+# 2: Station name
+URL_RE = "http:\/\/www\.nmc\.gov\.cn\/publish\/radar\/(stations-)?(.*)\.htm"
+IMAGE_RE = "http:\/\/image\.weather\.gov\.cn(.*)"
+
+# Frame links on a station page
+IMG_URL_RE = "javascript:view_text_img\((\'.*?\'),(\'.*?\'),'','','','',(\'.*?\'),'',(\'.*?\'),'',''\)"
+IMG_ENLARGE_RE = "(http:\/\/image\.weather\.gov\.cn)(.*)"
+
+# 1: Url
+# 2: Station ID
+# 3: YYYYMMDDHHmm or "%Y%m%d%H%M"
+# 4: YYYY
+# 5: MM
+# 6: DD
+# 7: HHmm
+TIME_STAMP_RE = "'?(\/product\/\d{4}\/\d{6}\/\d{8}\/RDCP\/SEVP_AOC_RDCP_SLDAS_EBREF_AZ(\d{4})_L88_PI_((\d{4})(\d{2})(\d{2})(\d{4})).*)'?"
+TIME_STAMP_FORMAT = "%Y%m%d%H%M"
+
+URL_PATTERN = re.compile(URL_RE)
+TIME_STAMP_PATTERN = re.compile(TIME_STAMP_RE)
+# 0: another station, 1: an image
+STATION_LINK_RULES = RuleSet([URL_RE, IMAGE_RE])
+# Url of the frame is group 2 of either rule
+FRAME_LINK_RULES = RuleSet([IMG_URL_RE, IMG_ENLARGE_RE])
@@ -1,16 +1,13 @@
 from google.appengine.ext import ndb
-from datetime import datetime
-import re
+from patterns import URL_PATTERN
 
 MODEL_VERSION = 3
 
 def get_parent_key(version = MODEL_VERSION):
   return ndb.Key('Station', "v%d" % (version))
 
-URL_RE = "http:\/\/www\.nmc\.gov\.cn\/publish\/radar\/(stations-)?(.*)\.htm"
-
 def get_name_from_url(url):
-  m = re.match(URL_RE, url)
+  m = URL_PATTERN.match(url)
   if m:
     return m.group(2)
   return ''
@@ -23,7 +20,6 @@ class Station(ndb.Model):
   last_commit = ndb.StringProperty()
   location = ndb.GeoPtProperty()
   frame_range = ndb.IntegerProperty()
-  _this_update = datetime.min
 
   @classmethod
   def create_query_for_all(cls):